@@ -0,0 +1,131 @@
+"""
+Run snippets with executor.py from an asyncio event loop.
+
+latexslides, and with it custom.ShellCode, only runs on Python 2, so this works
+on requests like those ShellCode.request() builds rather than on ShellCode
+objects:
+
+    results = await run_all(requests)
+
+Each result is a (transcript, overrun) pair, as custom.Worker returns them.
+
+Run as a script, it reads a JSON list of requests on stdin and writes the list
+of results on stdout; custom.execute_async drives it that way from a build:
+
+    python3 async_executor.py [concurrency] < requests.json
+"""
+
+import asyncio
+import collections
+import json
+import os
+import signal
+import sys
+from asyncio.subprocess import PIPE
+
+from executor import CRASHED, GRACE, SKIPPED, TIMEOUT
+
+EXECUTOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "executor.py")
+
+
+async def _start():
+    # In a session of its own, like custom._start, so killing gets everything
+    return await asyncio.create_subprocess_exec(
+        "python3", EXECUTOR, "batch", stdin=PIPE, stdout=PIPE, start_new_session=True)
+
+
+async def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    await process.wait()
+
+
+def _deadline(request):
+    timeout = request.get("timeout")
+    return timeout + GRACE if timeout else None
+
+
+async def run_batch(process, requests):
+    """
+    Run requests in order on process, a batch-mode executor, and return their
+    results. If it has to be killed, or dies, the results stop short with
+    that snippet's, and the process has exited.
+    """
+    # Buffered by the transport, so reading can start before it is all sent
+    process.stdin.write("".join(json.dumps(dict(request, id=i)) + "\n"
+                                for i, request in enumerate(requests)).encode())
+    results = []
+    for request in requests:
+        try:
+            line = await asyncio.wait_for(process.stdout.readline(), _deadline(request))
+        except asyncio.TimeoutError:
+            await _kill(process)
+            results.append((TIMEOUT % request["timeout"], "timeout"))
+            break
+        if not line:
+            await process.wait()
+            results.append((CRASHED, "crashed"))
+            break
+        try:
+            response = json.loads(line)
+        except ValueError:  # out of step with the executor, so drop it
+            await _kill(process)
+            results.append((CRASHED, "crashed"))
+            break
+        results.append((response["output"], response["overrun"]))
+    return results
+
+
+async def _slot(jobs, requests, results):
+    "Run jobs (lists of indices into requests) one after another on a warm executor"
+    process = None
+    try:
+        while jobs:
+            group = jobs.popleft()
+            if process is None or process.returncode is not None:
+                process = await _start()
+            batch = [requests[i] for i in group]
+            if batch[0].get("session") is not None:
+                batch[0] = dict(batch[0], fresh=True)
+            done = await run_batch(process, batch)
+            done += [(SKIPPED, "skipped")] * (len(batch) - len(done))
+            for i, result in zip(group, done):
+                results[i] = result
+    finally:
+        if process is not None and process.returncode is None:
+            process.stdin.close()
+            await process.wait()
+
+
+async def run_all(requests, concurrency=None):
+    """
+    Run requests concurrently on at most concurrency (by default one per CPU)
+    batch-mode executors, each kept for one request or session after another,
+    and return their results in the same order.
+
+    Requests naming the same session run one after another in one executor.
+    """
+    groups = []  # indices of requests that run together
+    sessions = {}
+    for i, request in enumerate(requests):
+        name = request.get("session")
+        if name is None:
+            groups.append([i])
+        elif name in sessions:
+            sessions[name].append(i)
+        else:
+            sessions[name] = [i]
+            groups.append(sessions[name])
+
+    jobs = collections.deque(groups)
+    results = [None] * len(requests)
+    slots = min(concurrency or os.cpu_count(), len(groups))
+    await asyncio.gather(*[_slot(jobs, requests, results) for _ in range(slots)])
+    return results
+
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    json.dump(asyncio.run(run_all(json.load(sys.stdin), concurrency)), sys.stdout)
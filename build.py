@@ -0,0 +1,202 @@
+"""
+Build lesson.pdf, redoing only the stages whose inputs changed:
+
+    python build.py [handout] [clear-cache]
+
+The stages, each feeding the next:
+
+    lesson.py  ->  compiled/lesson.tex  (the lesson, custom.py, latexslides, ...,
+                                         the python3 running snippets, Pygments)
+    pdflatex   ->  compiled/lesson.pdf  (the .tex, style files and figures;
+                                         rerun until the .aux files settle)
+
+The inputs and outputs of every stage are hashed into .buildstate. A stage is
+skipped when its inputs hash as they did last time and its outputs are still
+what it made, so a lesson that renders to the same .tex stops there.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+COMPILED = os.path.join(ROOT, "compiled")
+STATE = os.path.join(ROOT, ".buildstate")
+PYTHON = os.environ.get("PYTHON", "python")  # what lesson.py runs on
+MAX_LATEX_RUNS = 5
+AUX = (".aux", ".toc", ".nav", ".snm", ".out")  # what one pdflatex run leaves for the next
+FIGURE_EXTENSIONS = ("", ".pdf", ".png", ".jpg", ".jpeg", ".eps", ".ps")  # as \includegraphics tries them
+
+
+def _path(*parts):
+    return os.path.join(ROOT, *parts)
+
+
+def digest(paths, *extra):
+    "Hash of the names and contents of paths, and of extra"
+    h = hashlib.sha1()
+    for part in extra:
+        h.update(("%s\0" % (part,)).encode("utf-8"))
+    for path in sorted(paths):
+        h.update((os.path.relpath(path, ROOT) + "\0").encode("utf-8"))
+        try:
+            with open(path, "rb") as f:
+                h.update(f.read())
+        except IOError:
+            h.update(b"\0missing\0")
+    return h.hexdigest()
+
+
+class Stage(object):
+    """
+    A step of the build: run() makes outputs from inputs, both lists of
+    paths. inputs can also be a function returning them, for inputs that are
+    only known once the stages before have run. extra holds anything else
+    the result depends on, such as options.
+    """
+
+    def __init__(self, name, inputs, outputs, run, extra=()):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.run = run
+        self.extra = extra
+
+    def build(self, state, force=False):
+        "Run the stage unless it is up to date; return whether it ran"
+        inputs = digest(self.inputs() if callable(self.inputs) else self.inputs, *self.extra)
+        last = state.get(self.name, {})
+        if not force and last.get("inputs") == inputs and last.get("outputs") == digest(self.outputs):
+            print("%s: up to date" % self.name)
+            return False
+        print("%s: running" % self.name)
+        self.run()
+        state[self.name] = dict(inputs=inputs, outputs=digest(self.outputs))
+        return True
+
+
+def _check_call(command, cwd=ROOT):
+    if subprocess.call(command, cwd=cwd) != 0:
+        sys.exit("%s failed" % " ".join(command))
+
+
+def pygments_version():
+    """
+    The version of Pygments lesson.py highlights code with, or None if it
+    has none and leaves that to minted, which needs -shell-escape.
+    """
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen([PYTHON, "-c", "import pygments; print(pygments.__version__)"],
+                                   stdout=subprocess.PIPE, stderr=devnull)
+        output = process.communicate()[0]
+    return output.decode("ascii").strip() if process.returncode == 0 else None
+
+
+def _which(name):
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return name
+
+
+def interpreter_id():
+    "Identify the python3 that runs snippets, as custom._interpreter_id does"
+    path = os.path.realpath(_which("python3"))
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    return "%s:%d:%d" % (path, stat.st_mtime, stat.st_size)
+
+
+def latex_inputs():
+    """
+    What pdflatex reads besides its own .aux files: compiled/lesson.tex,
+    the other files in compiled/ (style files, figures) and the figures
+    lesson.tex includes from elsewhere.
+    """
+    tex = _path("compiled", "lesson.tex")
+    paths = set([tex])
+    for path in glob.glob(os.path.join(COMPILED, "*")):
+        if os.path.isfile(path) and not os.path.basename(path).startswith("lesson."):
+            paths.add(path)
+    try:
+        with open(tex, "rb") as f:
+            text = f.read().decode("latin-1")
+    except IOError:
+        text = ""
+    for name in re.findall(r"\\includegraphics(?:\[[^]]*\])?\{([^}]+)\}", text):
+        for extension in FIGURE_EXTENSIONS:
+            path = os.path.join(COMPILED, name + extension)
+            if os.path.isfile(path):
+                paths.add(os.path.normpath(path))
+                break
+    return sorted(paths)
+
+
+def _aux_files():
+    return [path for path in glob.glob(os.path.join(COMPILED, "lesson.*"))
+            if os.path.splitext(path)[1] in AUX]
+
+
+def run_latex(minted):
+    """
+    Run pdflatex on compiled/lesson.tex until the .aux files (the table of
+    contents, navigation and so on) come out as they went in.
+    """
+    command = ["pdflatex", "-synctex=1", "-interaction=nonstopmode", "lesson"]
+    if minted:
+        command.insert(1, "-shell-escape")
+    before = digest(_aux_files())
+    for run in range(MAX_LATEX_RUNS):
+        _check_call(command, cwd=COMPILED)
+        after = digest(_aux_files())
+        if after == before:
+            return
+        before = after
+    print("pdflatex: the .aux files still change after %d runs" % MAX_LATEX_RUNS)
+
+
+def stages(args):
+    pygments = pygments_version()
+    minted = pygments is None
+    lesson_inputs = ([_path("lesson.py"), _path("custom.py"), _path("executor.py"), _path("meta.py")] +
+                     glob.glob(_path("basics", "*.py")) + glob.glob(_path("latexslides", "*.py")))
+    options = [arg for arg in args if arg != "clear-cache"]
+    return [
+        Stage("lesson", lesson_inputs, [_path("compiled", "lesson.tex")],
+              lambda: _check_call([PYTHON, "lesson.py"] + args),
+              extra=[PYTHON, interpreter_id(), pygments] + options),
+        Stage("pdflatex", latex_inputs, [_path("compiled", "lesson.pdf")],
+              lambda: run_latex(minted), extra=[minted]),
+    ]
+
+
+def main(args):
+    try:
+        with open(STATE) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        state = {}
+    clear = "clear-cache" in args  # lesson.py has to run to clear its caches
+    for stage in stages(args):
+        stage.build(state, force=clear and stage.name == "lesson")
+        with open(STATE, "w") as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+
+    shutil.copy(_path("compiled", "lesson.pdf"), _path("lesson.pdf"))
+    try:
+        subprocess.Popen(["xdg-open", _path("lesson.pdf")])  # in the background
+    except OSError:
+        pass
+    subprocess.call(["sh", "clean.sh"], cwd=ROOT)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
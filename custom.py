@@ -1,38 +1,695 @@
+import atexit
+import hashlib
+import json
 import os
+import signal
+import sys
+from distutils.spawn import find_executable
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from threading import Condition, Lock, Thread, Timer, current_thread
 
 from latexslides import Code as OldCode, Content
 from subprocess import Popen, PIPE
 
+try:
+    from pygments import __version__ as pygments_version, highlight
+    from pygments.formatters import LatexFormatter
+    from pygments.lexers import get_lexer_by_name
+except ImportError:  # leave highlighting to minted, which needs latex -shell-escape
+    highlight = None
+
+EXECUTOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "executor.py")
+ASYNC_EXECUTOR = os.path.join(os.path.dirname(EXECUTOR), "async_executor.py")
+# As in executor.py, which is Python 3 and so cannot be imported here
+GRACE = 5  # seconds to wait past a snippet's timeout before killing its executor
+TIMEOUT = "\n*** timed out after %gs ***\n"
+CRASHED = "\n*** the interpreter crashed ***\n"
+SKIPPED = "\n*** not run: an earlier snippet in its session overran ***\n"
+
+overruns = []  # (limit, snippet) for every snippet stopped during this build
+
+
+def _start(command):
+    # In a process group of its own, so a stuck fork server goes with its children
+    return Popen(command, stdin=PIPE, stdout=PIPE, preexec_fn=os.setsid)
+
+
+def _kill(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:  # already gone
+        pass
+
+
+def _watchdog(timeout, kill):
+    "Call kill unless cancelled within timeout seconds (plus GRACE)"
+    if not timeout:
+        return None
+    watchdog = Timer(timeout + GRACE, kill)
+    watchdog.daemon = True
+    watchdog.start()
+    return watchdog
+
+
+class Worker(object):
+    """
+    A long-lived executor process serving snippet requests in batch mode,
+    where each snippet gets a fresh namespace and the executor's modules as
+    they were at startup (see executor.Baseline for what that leaves shared).
+
+    With preload set to a list of module names, the executor is a fork server
+    instead: it imports those modules once, then runs each snippet in a forked
+    child, so snippets start with the imports done and can never affect each
+    other.
+
+    Results are (transcript, overrun) pairs. The executor stops snippets that
+    overrun their limits itself; if one is stuck where it cannot be stopped,
+    the whole process is killed, and the results of a batch end with that
+    snippet's. If the executor dies by itself (a snippet calling os._exit,
+    say) or answers with something that is not a response, that snippet is
+    reported as crashed and the worker counts as killed.
+    """
+
+    def __init__(self, preload=None):
+        if preload is None:
+            command = ["python3", EXECUTOR, "batch"]
+        else:
+            command = ["python3", EXECUTOR, "forkserver"] + list(preload)
+        self.process = _start(command)
+        self.killed = False
+
+    def kill(self):
+        self.killed = True
+        _kill(self.process)
+
+    def _send(self, requests):
+        try:
+            for i, request in enumerate(requests):
+                self.process.stdin.write(json.dumps(dict(request, id=i)) + "\n")
+            self.process.stdin.flush()
+        except IOError:
+            if not self.killed:
+                raise
+            # Killed while requests were queued; _receive reports it
+
+    def _receive(self, requests):
+        results = []
+        for request in requests:
+            if self.killed:
+                break
+            watchdog = _watchdog(request.get("timeout"), self.kill)
+            response = self.process.stdout.readline()
+            if watchdog is not None:
+                watchdog.cancel()
+            if not response and self.killed:
+                results.append((TIMEOUT % request["timeout"], "timeout"))
+            elif not response:
+                self.killed = True
+                results.append((CRASHED, "crashed"))
+            else:
+                try:
+                    response = json.loads(response)
+                except ValueError:  # out of step with the executor, so drop it
+                    self.kill()
+                    results.append((CRASHED, "crashed"))
+                    break
+                results.append((response["output"].encode("utf-8"), response["overrun"]))
+        return results
+
+    def run(self, request):
+        self._send([request])
+        return self._receive([request])[0]
+
+    def run_batch(self, requests):
+        # Write from another thread so neither side blocks on a full pipe
+        writer = Thread(target=self._send, args=(requests,))
+        writer.start()
+        try:
+            return self._receive(requests)
+        finally:
+            writer.join()
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+class WorkerPool(object):
+    """
+    Warm executor processes shared by every ShellCode.
+
+    Workers are started on demand, up to size of them, and handed back to the
+    pool after each snippet, so a build only pays interpreter startup once per
+    worker instead of once per snippet. See Worker for preload, which must be
+    set before the first snippet runs.
+    """
+
+    def __init__(self, size=None, preload=None):
+        self.size = size or cpu_count()
+        self.preload = preload
+        self.workers = []
+        self.idle = []
+        # Notified whenever a worker is returned or discarded, as either
+        # lets a waiting thread go on
+        self.changed = Condition()
+
+    def _acquire(self):
+        with self.changed:
+            while not self.idle and len(self.workers) >= self.size:
+                self.changed.wait()
+            if self.idle:
+                return self.idle.pop()
+            worker = Worker(self.preload)
+            self.workers.append(worker)
+            return worker
+
+    def _release(self, worker):
+        with self.changed:
+            self.idle.append(worker)
+            self.changed.notify()
+
+    def run(self, request):
+        return self.run_batch([request])[0]
+
+    def run_batch(self, requests):
+        """
+        Run requests on one worker, in order. If the worker had to be killed,
+        the rest of the batch runs on a new one, unless it belongs to a
+        session, which cannot continue without the lost interpreter; then the
+        results stop short.
+        """
+        worker = self._acquire()
+        try:
+            results = [worker.run(requests[0])] if len(requests) == 1 else worker.run_batch(requests)
+        except Exception:
+            self._discard(worker)
+            raise
+        if not worker.killed:
+            self._release(worker)
+            return results
+        self._discard(worker)
+        rest = requests[len(results):]
+        if rest and rest[0].get("session") is None:
+            results += self.run_batch(rest)
+        return results
+
+    def _discard(self, worker):
+        with self.changed:
+            self.workers.remove(worker)
+            self.changed.notify()
+        worker.close()
+
+    def close(self):
+        with self.changed:
+            workers, self.workers = self.workers, []
+            self.idle = []
+        for worker in workers:
+            worker.close()
+
+
+pool = WorkerPool()
+atexit.register(pool.close)
+
+
+def _interpreter_id():
+    "Identify the python3 that runs snippets without starting it"
+    path = os.path.realpath(find_executable("python3") or "python3")
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path
+    return "%s:%d:%d" % (path, stat.st_mtime, stat.st_size)
+
+
+class TranscriptCache(object):
+    """
+    Transcripts of earlier runs, stored on disk under a hash of everything that
+    can change them: the parts given to key() (the snippet's mode, code, stdin
+    data and so on), the interpreter and executor.py itself.
+
+    Entries are evicted least recently used first once the directory grows past
+    max_bytes. clear() throws everything away.
+    """
+
+    def __init__(self, directory, max_bytes=32 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._salt = None
+        self._size = None
+        self.lock = Lock()
+
+    @property
+    def salt(self):
+        if self._salt is None:
+            with open(EXECUTOR, "rb") as f:
+                executor = hashlib.sha1(f.read()).hexdigest()
+            self._salt = "%s\0%s" % (_interpreter_id(), executor)
+        return self._salt
+
+    def key(self, *parts):
+        digest = hashlib.sha1(self.salt)
+        for part in parts:
+            if isinstance(part, unicode):
+                part = part.encode("utf-8")
+            elif not isinstance(part, str):
+                part = str(part)
+            digest.update("\0%d:%s" % (len(part), part))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                transcript = f.read()
+        except IOError:
+            return None
+        try:
+            os.utime(path, None)  # mark as recently used
+        except OSError:  # evicted meanwhile, by another thread or build
+            pass
+        return transcript
+
+    def put(self, key, transcript):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self._path(key)
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), current_thread().ident)
+        with open(tmp, "wb") as f:
+            f.write(transcript)
+        os.rename(tmp, path)
+        with self.lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(transcript)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):  # being written by put()
+                continue
+            path = self._path(name)
+            try:
+                stat = os.stat(path)
+            except OSError:  # removed by a concurrent build
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_bytes // 2:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # already evicted, by another thread or build
+                pass
+            self._size -= size
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._size = 0
+
+
+cache = TranscriptCache(os.path.join(os.path.dirname(EXECUTOR), ".shellcache"))
+
+
+class HighlightCache(TranscriptCache):
+    """
+    Pygments' LaTeX for earlier snippets, stored on disk under a hash of the
+    code, the language, the style, the formatter options and the version of
+    Pygments.
+    """
+
+    @property
+    def salt(self):
+        return "pygments %s" % pygments_version
+
+
+highlights = HighlightCache(os.path.join(os.path.dirname(EXECUTOR), ".highlightcache"))
+
+
+class Session(object):
+    """
+    ShellCode snippets that run one after another in the same interpreter, so
+    later ones see what earlier ones defined.
+
+    A session always runs as a whole, in the order its snippets were created.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.snippets = []
+
+    def context(self, snippet):
+        "Everything that ran in the session before snippet, as a cache key"
+        context = ""
+        for s in self.snippets:
+            if s is snippet:
+                break
+            context = s._key(context)
+        return context
+
+    def resolve(self):
+        transcripts = [s._lookup() for s in self.snippets]
+        if None in transcripts:
+            for s, result in zip(self.snippets, self._execute()):
+                s._finish(result)
+        else:
+            for s, transcript in zip(self.snippets, transcripts):
+                s._set_transcript(transcript)
+
+    def _execute(self):
+        requests = [dict(s.request(), session=self.name) for s in self.snippets]
+        requests[0]["fresh"] = True
+        if ShellCode.pool is not None:
+            results = ShellCode.pool.run_batch(requests)
+        else:
+            worker = Worker()
+            try:
+                results = worker.run_batch(requests)
+            finally:
+                worker.close()
+        return results + [(SKIPPED, "skipped")] * (len(requests) - len(results))
+
+
+sessions = {}
+
+
+MINTED_STYLE = "default"  # declared once in the preamble; blocks in other styles set their own
+
+
+def _style(language):
+    style = dict(python3="idleclassic", python="idleclassic").get(language, "default")
+    style = "default" # TODO: get this working without this
+    return style
+
+
+def _formatter(style, **options):
+    # Macros named after the style, so snippets in different styles can share a deck
+    prefix = "PY" + "".join([c for c in style if c.isalpha()])
+    return LatexFormatter(style=style, commandprefix=prefix, **options)
+
+
+_style_defs = {}
+
+
+def _preamble(language):
+    "What highlighted code in language needs in the preamble"
+    if highlight is None:
+        return ("%% #ifdef MINTED\n\\usemintedstyle{%s}\n%% #endif\n" % MINTED_STYLE,)
+    style = _style(language)
+    if style not in _style_defs:
+        _style_defs[style] = _formatter(style).get_style_defs() + "\n"
+    return (_style_defs[style],)
+
 
 class Code(OldCode):
+    """
+    Highlighted code. With Pygments installed it is highlighted here, into a
+    fancyvrb Verbatim block, so LaTeX needs neither -shell-escape nor
+    pygmentize; otherwise it is left to minted.
+    """
+    highlights = highlights  # set to None to always highlight
+
     def __init__(self, code='', file=False, language="python3", fontsize=r'\footnotesize', linenos=False, mathescape=True, **kwargs):
-        style = dict(python3="idleclassic", python="idleclassic").get(language, "default")
-        style = "default" # TODO: get this working without this
-        kwargs.update(fontsize=fontsize, linenos=linenos, mathescape=mathescape, numberblanklines=True)
-        kwargs = ",".join(["%s=%s" % (key, value) for key, value in kwargs.items()])
+        style = _style(language)
         code = open(code, "rU").read() if file else code
-        ltx = "\\usemintedstyle{%s}\n\\begin{minted}[%s]{%s}\n%s\n\\end{minted}" % (style, kwargs, language, code)
+        if highlight is None:
+            kwargs.update(fontsize=fontsize, linenos=linenos, mathescape=mathescape, numberblanklines=True)
+            kwargs = ",".join(["%s=%s" % (key, value) for key, value in kwargs.items()])
+            ltx = "\\begin{minted}[%s]{%s}\n%s\n\\end{minted}" % (kwargs, language, code)
+            if style != MINTED_STYLE:
+                # In a group, so the blocks after it are back in the deck's style
+                ltx = "{\\usemintedstyle{%s}\n%s}" % (style, ltx)
+        else:
+            # Any other minted options are fancyvrb ones, so Verbatim takes them
+            kwargs.pop("latex_envir", None)  # latexslides' Code option, not minted's
+            kwargs.update(fontsize=fontsize)
+            kwargs = ",".join(["%s=%s" % (key, value) for key, value in sorted(kwargs.items())])
+            ltx = self._highlight(code, language, style, linenos, mathescape, kwargs)
         Content.__init__(self, ltx)
+        self._preamble = _preamble(language)
+
+    def _highlight(self, code, language, style, linenos, mathescape, verboptions):
+        key = None
+        if self.highlights is not None:
+            key = self.highlights.key(code, language, style, linenos, mathescape, verboptions)
+            ltx = self.highlights.get(key)
+            if ltx is not None:
+                return ltx
+        formatter = _formatter(style, linenos=linenos, mathescape=mathescape, verboptions=verboptions)
+        ltx = highlight(code, get_lexer_by_name(language), formatter).rstrip("\n")
+        if isinstance(ltx, unicode):
+            ltx = ltx.encode("utf-8")  # as it comes back from the cache
+        if key is not None:
+            self.highlights.put(key, ltx)
+        return ltx
 
 
 class ShellCode(Code):
+    """
+    Code block showing the transcript of running code in the Python shell.
+
+    The snippet is not run when the slide is built; its content is resolved the
+    first time the LaTeX is needed, so slides that are never rendered never
+    execute. Snippets given the same session key share one interpreter (see
+    Session).
+
+    A snippet running longer than timeout seconds, or growing its executor
+    past memory bytes, is stopped; its slide shows what it printed up to then
+    and report() lists it at the end of the build. One printing more than
+    max_chars characters or max_lines lines is cut short with a "[...]" line.
+    """
     mode = "shell"
+    pool = pool  # set to None to run every snippet in its own interpreter
+    cache = cache  # set to None to always execute
+    timeout = 10
+    memory = 1024 * 2 ** 20
+    max_chars = 5000
+    max_lines = 50
 
     def __init__(self, code='', data="", fromfile=False, language="python3", fontsize=r'\footnotesize', linenos=False,
-                 mathescape=True, **kwargs):
+                 mathescape=True, session=None, timeout=None, memory=None, max_chars=None, max_lines=None, **kwargs):
         code = open(code, "rU").read() if fromfile else code
-        f = open("executing.py", "w")
-        f.write(code.strip("\n"))
-        f.close()
-        f = open("data.txt", "w")
-        f.write(data)
-        f.close()
-        code = Popen(["python3", "executor.py", self.mode], stdout=PIPE).communicate()[0]
-        super(ShellCode, self).__init__(code, False, language, fontsize, linenos, mathescape, **kwargs)
+        self.code = code.strip("\n")
+        self.data = data
+        if timeout is not None:
+            self.timeout = timeout
+        if memory is not None:
+            self.memory = memory
+        if max_chars is not None:
+            self.max_chars = max_chars
+        if max_lines is not None:
+            self.max_lines = max_lines
+        self.session = None
+        if session is not None:
+            self.session = sessions.setdefault(session, Session(session))
+            self.session.snippets.append(self)
+        self._format = (language, fontsize, linenos, mathescape, kwargs)
+        self._preamble = _preamble(language)
+        self._latex = None
+        self._dim = True
+        self._verbatim = True  # always a minted or Verbatim block
+
+    @property
+    def pending(self):
+        return self._latex is None
+
+    def request(self):
+        return dict(mode=self.mode, code=self.code, data=self.data, timeout=self.timeout, memory=self.memory,
+                    max_chars=self.max_chars, max_lines=self.max_lines)
+
+    def resolve(self):
+        if self._latex is None and self.session is not None:
+            self.session.resolve()
+        elif self._latex is None:
+            transcript = self._lookup()
+            if transcript is None:
+                self._finish(self._execute())
+            else:
+                self._set_transcript(transcript)
+        return self._latex
+
+    @property
+    def _ltx(self):
+        return self.resolve()
+
+    @_ltx.setter
+    def _ltx(self, value):
+        self._latex = value
+
+    def _finish(self, result):
+        transcript, overrun = result
+        if overrun is None:
+            self._store(transcript)
+        else:
+            overruns.append((overrun, self))
+        self._set_transcript(transcript)
+
+    def _set_transcript(self, transcript):
+        language, fontsize, linenos, mathescape, kwargs = self._format
+        super(ShellCode, self).__init__(transcript, False, language, fontsize, linenos, mathescape, **kwargs)
+
+    def _key(self, context=None):
+        if context is None:
+            context = self.session.context(self) if self.session is not None else ""
+        return self.cache.key(self.mode, self.code, self.data, context, self.max_chars, self.max_lines)
+
+    def _lookup(self):
+        if self.cache is not None:
+            return self.cache.get(self._key())
+
+    def _store(self, transcript):
+        if self.cache is not None:
+            self.cache.put(self._key(), transcript)
 
-        os.remove("data.txt")
-        os.remove("executing.py")
+    def _execute(self):
+        if self.pool is not None:
+            return self.pool.run(self.request())
+        process = _start(["python3", EXECUTOR, self.mode])
+        killed = []
 
+        def kill():
+            killed.append(True)
+            _kill(process)
+        watchdog = _watchdog(self.timeout, kill)
+        response = process.communicate(json.dumps(self.request()) + "\n")[0]
+        if watchdog is not None:
+            watchdog.cancel()
+        if not response and killed:
+            return TIMEOUT % self.timeout, "timeout"
+        if not response:
+            return CRASHED, "crashed"
+        try:
+            response = json.loads(response)
+        except ValueError:
+            return CRASHED, "crashed"
+        return response["output"].encode("utf-8"), response["overrun"]
 
-class ExecCode(Code):
+
+class ExecCode(ShellCode):
+    """
+    Code block showing the output of running code as a whole program, with
+    the prompts and answers of input() echoed where they happen.
+    """
     mode = "exec"
+
+
+def execute_all(slides, processes=None):
+    """
+    Run every pending ShellCode in the presentation at once, spread over the
+    worker pool in batches, instead of one after another as the slides are
+    rendered.
+
+    Each transcript is stored on its own ShellCode, so the rendered output is
+    the same as running them in order.
+    """
+    snippets = []
+    batches = []
+    for c in slides.iter_content():
+        if isinstance(c, ShellCode) and c.pending and c.session is not None:
+            if c.session not in batches:
+                batches.append(c.session)
+        elif isinstance(c, ShellCode) and c.pending:
+            transcript = c._lookup()
+            if transcript is None:
+                snippets.append(c)
+            else:
+                c._set_transcript(transcript)
+    if ShellCode.pool is None:
+        batches += [[snippet] for snippet in snippets]
+    else:
+        # Several batches per thread, so one slow batch does not hold up the rest
+        size = len(snippets) // ((processes or ShellCode.pool.size) * 4) + 1
+        batches += [snippets[i:i + size] for i in range(0, len(snippets), size)]
+    if not batches:
+        return
+    threads = ThreadPool(processes or cpu_count())
+    try:
+        threads.map(_execute_batch, batches)
+    finally:
+        threads.close()
+        threads.join()
+
+
+def _pending(slides):
+    """
+    The ShellCode snippets in the presentation that have to run, each session
+    whole and in order. Plain snippets found in the cache get their
+    transcripts here, as in execute_all.
+    """
+    snippets = []
+    seen = []
+    for c in slides.iter_content():
+        if not isinstance(c, ShellCode) or not c.pending:
+            continue
+        if c.session is not None:
+            if c.session not in seen:
+                seen.append(c.session)
+                if None in [s._lookup() for s in c.session.snippets]:
+                    snippets += c.session.snippets
+        else:
+            transcript = c._lookup()
+            if transcript is None:
+                snippets.append(c)
+            else:
+                c._set_transcript(transcript)
+    return snippets
+
+
+def execute_async(slides, concurrency=None):
+    """
+    Like execute_all, but run the snippets with async_executor: one Python 3
+    process keeping a batch executor warm for each of concurrency (by
+    default one per CPU) slots.
+    """
+    snippets = _pending(slides)
+    if not snippets:
+        return
+    requests = []
+    for snippet in snippets:
+        request = snippet.request()
+        if snippet.session is not None:
+            request["session"] = snippet.session.name
+        requests.append(request)
+    command = ["python3", ASYNC_EXECUTOR] + ([str(concurrency)] if concurrency else [])
+    process = Popen(command, stdin=PIPE, stdout=PIPE)
+    output = process.communicate(json.dumps(requests))[0]
+    if process.returncode != 0:
+        raise RuntimeError("async_executor.py failed")
+    for snippet, (transcript, overrun) in zip(snippets, json.loads(output)):
+        snippet._finish((transcript.encode("utf-8"), overrun))
+
+
+def _execute_batch(snippets):
+    if isinstance(snippets, Session):
+        snippets.resolve()
+        return
+    if ShellCode.pool is None:
+        results = [snippet._execute() for snippet in snippets]
+    else:
+        results = ShellCode.pool.run_batch([snippet.request() for snippet in snippets])
+    for snippet, result in zip(snippets, results):
+        snippet._finish(result)
+
+
+def report():
+    "Tell the author about snippets that were stopped during this build"
+    if not overruns:
+        return
+    sys.stderr.write("%d snippet(s) went over their limits:\n" % len(overruns))
+    for overrun, snippet in overruns:
+        first_line = (snippet.code.splitlines() or [""])[0]
+        sys.stderr.write("    %s: %s\n" % (overrun, first_line))
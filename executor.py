@@ -1,9 +1,35 @@
 #! /usr/bin/python3
 
+import builtins
+import importlib
+import json
+import os
+import resource
+import signal
 import sys
+import tempfile
+import traceback
 from code import InteractiveConsole
 from io import StringIO
 
+TIMEOUT = "\n*** timed out after %gs ***\n"
+OUT_OF_MEMORY = "\n*** stopped: over the %dMB memory limit ***\n"
+CRASHED = "\n*** the interpreter crashed ***\n"
+TRUNCATED = "[...]\n"
+# For clients: how long past a snippet's timeout to wait before killing the
+# executor, and the transcript of a session snippet that never ran
+GRACE = 5
+SKIPPED = "\n*** not run: an earlier snippet in its session overran ***\n"
+
+class Overrun(BaseException):
+    "Raised in a snippet that runs past its time limit"
+
+class Truncated(BaseException):
+    "Raised in a snippet once it has printed all that fits on a slide"
+
+def alarm(signum, frame):
+    raise Overrun()
+
 class Stdin(StringIO):
     def __init__(self, data):
         self.data = data
@@ -20,13 +46,82 @@ def myinput(prompt=""):
     FileCacher.instance.write(prompt + value + "\n")
     return value
 
-class FileCacher:
-    "Cache the stdout text so we can analyze it before returning it"
+class Capture:
+    """
+    Where fd 1 points while serving, so what snippets write there directly
+    (sys.__stdout__, os.system("echo hi"), ...) joins their transcript
+    instead of the protocol stream. take() returns what has arrived since
+    it was last called, or since reset().
+    """
     def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.fd = self.file.fileno()
+        self.reset()
+
+    def reset(self):
+        os.ftruncate(self.fd, 0)
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        self.upto = 0
+
+    def take(self):
+        try:
+            sys.__stdout__.flush()
+        except (AttributeError, ValueError):  # replaced or closed by the snippet
+            pass
+        chunks = []
+        while True:
+            # pread leaves the offset the writers share alone
+            chunk = os.pread(self.fd, 65536, self.upto)
+            if not chunk:
+                return b"".join(chunks).decode("utf-8", "replace")
+            chunks.append(chunk)
+            self.upto += len(chunk)
+
+capture = None  # the Capture, once protocol_streams() has moved fd 1 to it
+
+class FileCacher:
+    """
+    Cache the stdout text so we can analyze it before returning it.
+
+    At most max_chars characters and max_lines lines are kept over the life of
+    the cacher; the write that goes past either ends with TRUNCATED and raises
+    Truncated, so the snippet stops as soon as nothing more would be shown.
+    """
+    def __init__(self, max_chars=None, max_lines=None):
+        self.chars_left = max_chars
+        self.lines_left = max_lines
         self.reset()
         FileCacher.instance = self
     def reset(self): self.out = []
-    def write(self,line): self.out.append(line)
+    def catch_up(self):
+        "Take in what the snippet wrote to fd 1 since the last write"
+        if capture is not None:
+            self.write("")
+    def write(self, line):
+        if capture is not None:
+            line = capture.take() + line
+        cut = None
+        if self.chars_left is not None and len(line) > self.chars_left:
+            cut = self.chars_left
+        if self.lines_left is not None and line.count("\n") >= self.lines_left:
+            end = -1
+            for _ in range(self.lines_left):
+                end = line.index("\n", end + 1)
+            if end + 1 < len(line):
+                cut = end + 1 if cut is None else min(cut, end + 1)
+        if cut is None:
+            self.out.append(line)
+            if self.chars_left is not None:
+                self.chars_left -= len(line)
+            if self.lines_left is not None:
+                self.lines_left -= line.count("\n")
+            return
+        line = line[:cut]
+        if line and not line.endswith("\n"):
+            line += "\n"
+        self.out.append(line + TRUNCATED)
+        self.chars_left = self.lines_left = 0
+        raise Truncated()
     def flush(self):
         output = ''.join(self.out)
         self.reset()
@@ -44,15 +139,15 @@ class ErrorCatcher(FileCacher):
 class Shell(InteractiveConsole):
     "Wrapper around Python that can filter input/output to the shell"
 
-    def __init__(self, code, inputs):
+    def __init__(self, code, inputs, namespace=None, max_chars=None, max_lines=None):
         self.stdin = Stdin(inputs)
         sys.stdin = self.stdin
-        self.cache = FileCacher()
+        self.cache = FileCacher(max_chars, max_lines)
         self.stdout = sys.stdout
         self.upto = 0
         self.code = code
-        self.output = ""
-        super(Shell, self).__init__()
+        self.output = []
+        super(Shell, self).__init__(namespace)
         self.locals['input'] = myinput
 
 
@@ -74,6 +169,13 @@ class Shell(InteractiveConsole):
         # line = filter(line)
         try:
             InteractiveConsole.push(self,line)
+            self.cache.catch_up()
+        except SystemExit:
+            # Like the real console, exiting ends the session
+            self.upto = len(self.code)
+            self.cache.catch_up()
+        except (Overrun, Truncated, MemoryError):
+            raise
         except Exception as e:
             raise TypeError
         sys.stdout = self.stdout  # put stdout back to what it should be
@@ -81,10 +183,16 @@ class Shell(InteractiveConsole):
         # you can filter the output here by doing something like
         # output = filter(output)
         # print(output) # or do something else with it
-        self.output += output
+        self.output.append(output)
         # more if the next line is indented
         return self.upto < len(self.code) and self.code[self.upto][0] in " \t"
 
+    def showtraceback(self):
+        # Limits stop the whole snippet, not just the current line
+        if isinstance(sys.exc_info()[1], (Overrun, Truncated, MemoryError)):
+            raise
+        super(Shell, self).showtraceback()
+
     def interact(self, banner=None):
         """Closely emulate the interactive Python console.
 
@@ -104,7 +212,7 @@ class Shell(InteractiveConsole):
                 prompt = sys.ps2 if more else sys.ps1
                 try:
                     line = self.raw_input(prompt)
-                    self.output += prompt + line
+                    self.cache.write(prompt + line)
                 except EOFError:
                     self.write("\n")
                     break
@@ -115,10 +223,181 @@ class Shell(InteractiveConsole):
                 self.resetbuffer()
                 more = 0
 
-mode = sys.argv[1]
-code = open("executing.py", "rU").readlines()
-inputs = open("data.txt", "rU").readlines()
-if mode == "shell":
-    sh = Shell(code, inputs)
-    sh.interact()
-    print(sh.output)
\ No newline at end of file
+def execute(source, inputs, namespace=None, max_chars=None, max_lines=None):
+    "Run source as a whole program and return what it printed"
+    sys.stdin = Stdin(inputs)
+    cache = FileCacher(max_chars, max_lines)
+    if namespace is None:
+        namespace = {"__name__": "__main__", "__builtins__": builtins}
+    namespace["input"] = myinput
+    sys.stdout = cache
+    try:
+        program = compile(source, "<snippet>", "exec")
+        exec(program, namespace)
+        cache.catch_up()
+    except SystemExit:
+        cache.catch_up()
+    except (Overrun, Truncated, MemoryError):
+        raise
+    except SyntaxError as e:
+        cache.write("".join(traceback.format_exception_only(type(e), e)))
+    except BaseException as e:
+        # skip this frame, so the traceback starts in the snippet
+        cache.write("".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next)))
+    return cache.flush()
+
+def run(request, namespace=None):
+    """
+    Run a snippet in namespace, or a fresh one, and return its transcript and
+    which limit it overran, if any.
+
+    The request's timeout (seconds) and memory (bytes) limits are optional. A
+    snippet that overruns is stopped, and its transcript is what it printed so
+    far followed by a marker. So is one that prints more than its max_chars or
+    max_lines, but that is not reported as an overrun.
+    """
+    stdin, stdout = sys.stdin, sys.stdout
+    code = request["code"].strip("\n").splitlines(True)
+    inputs = request["data"].splitlines(True)
+    timeout, memory = request.get("timeout"), request.get("memory")
+    budget = request.get("max_chars"), request.get("max_lines")
+    address_space = resource.getrlimit(resource.RLIMIT_AS)
+    sh = None
+    if capture is not None:
+        capture.reset()
+    try:
+        if memory:
+            resource.setrlimit(resource.RLIMIT_AS, (memory, address_space[1]))
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        if request["mode"] == "shell":
+            sh = Shell(code, inputs, namespace, *budget)
+            sh.interact()
+            return "".join(sh.output) + "\n", None
+        if request["mode"] == "exec":
+            return execute("".join(code), inputs, namespace, *budget), None
+        return "", None
+    except Truncated:
+        return "".join(sh.output if sh else []) + FileCacher.instance.flush(), None
+    except (Overrun, MemoryError) as e:
+        output = "".join(sh.output if sh else []) + FileCacher.instance.flush()
+        if isinstance(e, MemoryError):
+            return output + OUT_OF_MEMORY % (memory // 2 ** 20), "memory"
+        return output + TIMEOUT % timeout, "timeout"
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        resource.setrlimit(resource.RLIMIT_AS, address_space)
+        sys.stdin, sys.stdout = stdin, stdout
+
+def run_forked(request):
+    "Run a snippet in a forked child, so this process never sees its side effects"
+    reader, writer = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(reader)
+        try:
+            with os.fdopen(writer, "w") as result:
+                json.dump(run(request), result)
+        finally:
+            os._exit(0)
+    os.close(writer)
+    with os.fdopen(reader) as result:
+        output = result.read()
+    os.waitpid(pid, 0)
+    return json.loads(output) if output else (CRASHED, "crashed")
+
+class Baseline:
+    """
+    The modules (and builtins) loaded when the executor starts serving, to
+    put back before each snippet that starts afresh: modules it imported are
+    forgotten and attributes it set or deleted on the others (json.x = 1)
+    are undone, so its transcript does not depend on what ran before it.
+
+    Objects changed in place (os.environ, a list held by a module) and
+    process state such as the working directory are not put back; only the
+    forkserver mode, which runs each snippet outside a session in a forked
+    child, isolates those too.
+    """
+    def __init__(self):
+        self.modules = dict(sys.modules)
+        self.attributes = dict((name, dict(vars(module))) for name, module in self.modules.items()
+                               if module is not None)
+
+    def restore(self):
+        for name in list(sys.modules):
+            if name not in self.modules:
+                del sys.modules[name]
+        sys.modules.update(self.modules)
+        for name, attributes in self.attributes.items():
+            namespace = vars(self.modules[name])
+            for key in [key for key in namespace if key not in attributes]:
+                del namespace[key]
+            for key, value in attributes.items():
+                if namespace.get(key, attributes) is not value:
+                    namespace[key] = value
+
+# Requests and responses are JSON objects, one per line, so code and stdin
+# data of any content can share a pipe with no scratch files. In batch mode
+# each request carries an id that is echoed back with its output, so a client
+# can queue a whole lesson before reading any results. Requests naming a
+# session share one namespace, which the first of them marks as fresh.
+# Every snippet that starts a namespace also starts from the modules of the
+# baseline, taken when serving starts.
+def read_request(stream):
+    line = stream.readline()
+    return json.loads(line) if line else None
+
+def write_response(stream, **response):
+    stream.write(json.dumps(response) + "\n")
+    stream.flush()
+
+def protocol_streams():
+    """
+    Move the protocol off fds 0 and 1, where snippets and the processes they
+    start could read requests or write into responses, and return streams
+    for it. fd 0 then reads from /dev/null and fd 1 writes to a Capture.
+    """
+    global capture
+    requests = os.fdopen(os.dup(0), "r")
+    responses = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    capture = Capture()
+    os.dup2(capture.fd, 1)
+    return requests, responses
+
+def serve(requests, responses, runner=run):
+    "Answer requests in order until the client closes the pipe"
+    sessions = {}
+    baseline = Baseline()
+    request = read_request(requests)
+    while request is not None:
+        name = request.get("session")
+        if name is None:
+            baseline.restore()
+            output, overrun = runner(request)
+        else:
+            if request.get("fresh") or name not in sessions:
+                baseline.restore()
+                sessions[name] = {"__name__": "__console__", "__doc__": None}
+            # Never forked: the namespace has to outlive the snippet
+            output, overrun = run(request, sessions[name])
+        write_response(responses, id=request.get("id"), output=output, overrun=overrun)
+        request = read_request(requests)
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGALRM, alarm)
+    mode = sys.argv[1]
+    requests, responses = protocol_streams()
+    if mode == "batch":
+        serve(requests, responses)
+    elif mode == "forkserver":
+        # Pay for heavy imports once; every snippet starts from a copy of this
+        for name in sys.argv[2:]:
+            importlib.import_module(name)
+        serve(requests, responses, run_forked)
+    else:
+        request = read_request(requests)
+        output, overrun = run(dict(request, mode=mode))
+        write_response(responses, output=output, overrun=overrun)
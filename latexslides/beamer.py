@@ -236,18 +236,20 @@ class BeamerSlides(Slides):
 
         if isinstance(slide, RawSlide):
             c = slide.content[0]
-            self.renderContent[type(c)](c)
+            self._renderContent(c)
             return
+        figs = slide._fig_latex(self.context.fig_scale)
 
         options = []
         if not self.header_footer:
             options.append("plain")
 
+        fragile = slide._fragile
         for c in slide.content:
-            if not slide._fragile and c.containsVerbatim:
-                slide._fragile = True
+            if not fragile and c.containsVerbatim:
+                fragile = True
             
-        if slide._fragile:
+        if fragile:
             options.append("fragile")
         if options:  # Any options must be enclosed in brackets
             options = '[%s]' % ",".join(options)
@@ -262,12 +264,12 @@ class BeamerSlides(Slides):
 """ % (options, slide.title))
 
         # If figure is to the north:
-        if slide._fig and slide._fig_pos == 'n':
-            width = 1./len(slide._fig)
+        if figs and slide._fig_pos == 'n':
+            width = 1./len(figs)
             self.buf.write(r"""
 \begin{columns}
 """ )
-            for i in slide._fig:
+            for i in figs:
                 self.buf.write(r"""
 \column{%g\textwidth}
 %s
@@ -277,12 +279,12 @@ class BeamerSlides(Slides):
 """)
 
         # If figure is to the west:
-        if slide._fig and slide._fig_pos == 'w':
+        if figs and slide._fig_pos == 'w':
             self.buf.write(r"""
 \begin{columns}
 \column{%g\textwidth}
 """ %(slide._left_column_width))
-            for i in slide._fig:
+            for i in figs:
                 self.buf.write(r"""
 %s
 """ %(i))
@@ -291,7 +293,7 @@ class BeamerSlides(Slides):
 """ %(slide._right_column_width))
 
         # If figure is to the east:
-        if slide._fig and slide._fig_pos == 'e':
+        if figs and slide._fig_pos == 'e':
             self.buf.write(r"""
 \begin{columns}
 \column{%g\textwidth}
@@ -304,22 +306,22 @@ class BeamerSlides(Slides):
         if slide._dim == 'blocks':
             self.buf.write(r"\pause" + "\n")
         for c in slide.content[:-1]:
-            self.renderContent[type(c)](c)
+            self._renderContent(c)
         for c in slide.content[-1:]:
             if slide._dim == 'blocks':
                 self._dim = False
-                self.renderContent[type(c)](c)
+                self._renderContent(c)
             else:
-                self.renderContent[type(c)](c)
+                self._renderContent(c)
         self._dim = False
         self._dimi = 0
 
         # If figure is to the east:
-        if slide._fig and slide._fig_pos == 'e':
+        if figs and slide._fig_pos == 'e':
             self.buf.write(r"""
 \column{%g\textwidth}
 """ %(slide._right_column_width))
-            for i in slide._fig:
+            for i in figs:
                 self.buf.write(r"""
 %s
 """ %(i))
@@ -328,18 +330,18 @@ class BeamerSlides(Slides):
 """)
 
         # If figure is to the west:
-        if slide._fig and slide._fig_pos == 'w':
+        if figs and slide._fig_pos == 'w':
             self.buf.write(r"""
 \end{columns}
 """)
 
         # If figure is to the south:
-        if slide._fig and slide._fig_pos == 's':
-            width = 1./len(slide._fig)
+        if figs and slide._fig_pos == 's':
+            width = 1./len(figs)
             self.buf.write(r"""
 \begin{columns}
 """)
-            for i in slide._fig:
+            for i in figs:
                 self.buf.write(r"""
 \column{%g\textwidth}
 %s
@@ -353,25 +355,13 @@ class BeamerSlides(Slides):
 """)
         self._dim = False
 
-    def _renderSection(self, section):
-        self.buf.write("\n")
+    def _renderSectionTitle(self, section):
         self.buf.write(r"""\section%s{%s}
 """% (section._short_title, section._title))
-        # Top-level slides
-        for s in section.slides:
-            self.buf.write("\n")
-            self._renderSlide(s)
-        # Nested slides
-        for s in section.subsections:
-            self.buf.write("\n")
-            self._renderSubsection(s)
-
-    def _renderSubsection(self, subsection):
+
+    def _renderSubsectionTitle(self, subsection):
         self.buf.write(r"""\subsection%s{%s}
 """ % (subsection._short_title, subsection._title))
-        for s in subsection.slides:
-            self.buf.write("\n")
-            self._renderSlide(s)
 
     def _renderBulletList(self, bulletlist):
         dims = ['' for i in range(len(bulletlist.bullets))]
@@ -439,7 +429,7 @@ class BeamerSlides(Slides):
                     self.buf.write(r'\item%s ' %d)
                     if isinstance(bi, basestring):
                         bi = Text(bi)
-                    self.renderContent[type(bi)](bi)
+                    self._renderContent(bi)
                 self.buf.write(r'\end{itemize}' + '\n')
             elif isinstance(b, BulletList):
                 pass
@@ -448,24 +438,25 @@ class BeamerSlides(Slides):
                 self.buf.write(r"\item%s " %d)
                 if isinstance(b, basestring):
                     b = Text(b)
-                self.renderContent[type(b)](b)
+                self._renderContent(b)
         if bulletlist.bullets:
             self.buf.write(r"""\end{itemize}
 """)
 
     def _renderBlock(self, block):
-        if Block.unblock:
+        if self.context.unblock:
             if block.heading:
                 self.buf.write(r"""{\bf %s
 
 """ % block.heading)
         else:
-            if block.heading:
-                block.heading = "{%s}" % block.heading
+            heading = block.heading
+            if heading:
+                heading = "{%s}" % heading
             self.buf.write(r"""
 \begin{block}%s
 
-""" % block.heading)
+""" % heading)
 
         if isinstance(block, TableBlock):
             if block.center:
@@ -474,13 +465,13 @@ class BeamerSlides(Slides):
         for c in block.content:
             if isinstance(c, basestring):
                 c = Text(c)
-            self.renderContent[type(c)](c)
+            self._renderContent(c)
 
         if isinstance(block, TableBlock):
             if block.center:
                 self.buf.write(r"""\end{center}""")
 
-        if Block.unblock:
+        if self.context.unblock:
             pass
         else:
             self.buf.write(r"""
@@ -510,17 +501,7 @@ class BeamerSlides(Slides):
         else:
             ptex2tex_line = ''
         # Check if latex or pdflatex, depending on figure extensions
-        text = self.get_latex()
-        import re
-        pattern = 'includegraphics\[.+?\]\{(.+?)\}'
-        figfiles = re.findall(pattern, text)
-        figfiletypes = {}
-        for fname in figfiles:
-            ext = os.path.splitext(fname)[1]
-            if not ext in figfiletypes:
-                figfiletypes[ext] = 1
-            else:
-                figfiletypes[ext] += 1
+        figfiletypes = self._figure_types()
         def check(illegal):
             # Check if other illegal image types are present
             for name in illegal:
@@ -14,7 +14,7 @@ __all__ = ["BulletSlide", "Slide", "TextSlide", "TableSlide", "RawSlide",
            "BulletBlock", "TableBlock", "Text", "Table", "BulletList",
            "Code", "generate", "Section", "SubSection", "Slides"]
 
-import re, os, sys
+import re, os, sys, hashlib, inspect, multiprocessing
 from cStringIO import StringIO
 
 def _latextable(table,
@@ -89,15 +89,15 @@ class Content(object):
     """Basic primitive that can be rendered into LaTeX code."""
     fig_scale = 1.0
     font_scale = False
+    _figures = []  # files the LaTeX code includes, see _figure_files
+    _preamble = ()  # LaTeX it needs in the document preamble, see Slides._iter_pieces
+    _memos = ()  # attributes only remembering what the others make, see _fingerprint
     def __init__(self, latex_code, dim=True):
         # Used to be latex_code.strip()
         self._ltx = latex_code
         self._dim = dim
-        self._verbatim = False
-        for p in _verbatim_phrases():
-            if self._ltx.find(p) != -1:
-                self._verbatim = True
-                break
+        self._verbatim = _verbatim_re.search(self._ltx) is not None
+        self._figures = _includegraphics_re.findall(self._ltx)
 
     def checkVerbatim(self, bullets):
         self._verbatim = _verbatim_text(bullets)
@@ -250,36 +250,53 @@ def verbatimCode(code, file, from_regex, to_regex,
 class Code(Content):
     ptex2tex_envir = None     # implies LaTeX environment latex_envir
     latex_envir = None        # used if ptex2tex_envir is None
+    _source = None            # the arguments, to make the LaTeX again
+    _memos = ('_built',)      # the LaTeX made for each context so far
 
     def __init__(self, code='', file=None, from_regex=None, to_regex=None,
                  leftmargin='7mm', fontsize=r'\footnotesize',  # Verbatim
                  ptex2tex_envir=None, latex_envir=None):
+        self._source = (code, file, from_regex, to_regex, leftmargin,
+                        fontsize, ptex2tex_envir, latex_envir)
+        self._built = {}
+        Content.__init__(self, self.latex(RenderContext()))
 
+    def latex(self, context):
+        """
+        The LaTeX for this code in a deck rendering with context, which
+        supplies the environment and font scaling not given explicitly.
+        """
+        if self._source is None:  # a subclass that made its own _ltx
+            return self._ltx
+        key = (context.ptex2tex_envir, context.latex_envir, context.font_scale)
+        if key not in self._built:
+            self._built[key] = self._build(context)
+        return self._built[key]
+
+    def _build(self, context):
+        code, file, from_regex, to_regex, leftmargin, fontsize, \
+              ptex2tex_envir, latex_envir = self._source
         if ptex2tex_envir is None:
-            if Code.ptex2tex_envir is not None:
-                # Use class "global" variable, set by the user
-                ptex2tex_envir = Code.ptex2tex_envir
+            ptex2tex_envir = context.ptex2tex_envir
         if latex_envir is None:
-            if Code.latex_envir is not None:
-                # Use class "global" variable, set by the user
-                latex_envir = Code.latex_envir
+            if context.latex_envir is not None:
+                latex_envir = context.latex_envir
             else:
                 latex_envir = 'Verbatim'
 
         # For Verbatim/minted environment (latex_envir)
         if not fontsize.startswith('\\'):
             fontsize = '\\' + fontsize
-        if Content.font_scale:
+        if context.font_scale:
             # Adjust fontsize
             if fontsize == r'\footnotesize':
                 fontsize = r'\tiny'
             elif fontsize == r'\small':
                 fontsize = r'\footnotesize'
 
-        ltx = verbatimCode(code, file, from_regex, to_regex,
-                           leftmargin, fontsize, ptex2tex_envir,
-                           latex_envir)
-        Content.__init__(self, ltx)
+        return verbatimCode(code, file, from_regex, to_regex,
+                            leftmargin, fontsize, ptex2tex_envir,
+                            latex_envir)
 
     def __str__(self):
         return str(self._ltx)
@@ -297,6 +314,19 @@ class Code(Content):
             raise TypeError, 'Cannot add Code and Text, use comma'
         return other + self._ltx
 
+class RenderContext(object):
+    """
+    Settings that change how a deck renders its content. Each Slides
+    has its own, starting out from the class-wide defaults below, so
+    decks with different settings can render the same slides side by side.
+    """
+    def __init__(self):
+        self.ptex2tex_envir = Code.ptex2tex_envir
+        self.latex_envir = Code.latex_envir
+        self.font_scale = Content.font_scale
+        self.fig_scale = Content.fig_scale
+        self.unblock = Block.unblock
+
 class Table(Content):
     def __init__(self, table, column_headline_pos='c', column_pos='c'):
         """
@@ -360,40 +390,81 @@ class TableBlock(Block):
                        content=[Table(table, column_headline_pos, column_pos)])
 
 
-def _verbatim_phrases():
+def _ptex2tex_envirs():
     pro = ' pro pypro cypro cpppro cpro fpro pl pro shpro mpro'
     cod = pro.replace('pro', 'cod')
-    ptex2tex_envirs = 'ccq cc ccl cod pro cppans pyans bashans swigans uflans sni dat dsni sys slin py rpy plin' + pro + cod
+    return 'ccq cc ccl cod pro cppans pyans bashans swigans uflans sni dat dsni sys slin py rpy plin' + pro + cod
+
+def _verbatim_phrases():
+    ptex2tex_envirs = _ptex2tex_envirs()
     ptex2tex_phrases = ['\\e' + envir for envir in ptex2tex_envirs]
     phrases = ['{Verbatim}', '{verbatim}', 'SaveVerbatim', '{minted}'] + ptex2tex_phrases
     return phrases
 
+# All the phrases in one pattern, so finding any of them is a single scan
+_verbatim_re = re.compile('|'.join([re.escape(p) for p in sorted(set(_verbatim_phrases()))]))
+
+_includegraphics_re = re.compile(r'includegraphics\[.+?\]\{(.+?)\}')
+
+# What "\begin" and "\texttt" turn into when typed without a raw string
+_unraw_re = re.compile('\b|' + r'\sexttt\{.+\}')
+
 def _verbatim_text(bullets):
     """
     Check if we have verbatim text (i.e., if we need a fragile command
     in a beamer frame).
     """
-    verbatim = False
-    phrases = _verbatim_phrases()
-
     for item in bullets:
         if isinstance(item, (list,tuple)):
             for item2 in item:
-                for p in phrases:
-                    if item2.find(p) != -1:
-                        return True
+                if _verbatim_re.search(item2):
+                    return True
         elif isinstance(item, (BulletList)):
             return _verbatim_text(item.bullets)
         elif isinstance(item, (Text, Code, Table)):
-            for p in phrases:
-                if item._ltx.find(p) != -1:
-                    return True
+            # Already worked out from _ltx by Content.__init__
+            if item._verbatim:
+                return True
         else:
-            for p in phrases:
-                if item.find(p) != -1:
-                    return True
+            if _verbatim_re.search(item):
+                return True
     return False
 
+def _figure_files(items):
+    """
+    Names of the figure files included by items, which are Content
+    objects or strings, possibly in nested lists, blocks and bullet lists.
+    """
+    files = []
+    for item in items:
+        if isinstance(item, basestring):
+            files += _includegraphics_re.findall(item)
+        elif isinstance(item, (list, tuple)):
+            files += _figure_files(item)
+        elif isinstance(item, Block):
+            files += _figure_files(item.content)
+        elif isinstance(item, BulletList):
+            files += _figure_files(item.bullets)
+        elif isinstance(item, Content):
+            files += item._figures
+    return files
+
+def _iter_content(items):
+    for item in items:
+        if isinstance(item, (list, tuple)):
+            for c in _iter_content(item):
+                yield c
+        elif isinstance(item, Block):
+            yield item
+            for c in _iter_content(item.content):
+                yield c
+        elif isinstance(item, BulletList):
+            yield item
+            for c in _iter_content(item.bullets):
+                yield c
+        elif isinstance(item, Content):
+            yield item
+
 class Slide(object):
     """
     A presentation slide.
@@ -415,10 +486,11 @@ class Slide(object):
         if dim not in('single', 'single_then_all', 'progressive', 'blocks', True, False):
             raise ValueError, 'wrong argument value of dim argument: %s' %dim
         self._dim = dim
-        self._buf = LatexBuffer()
         self._fragile = False
         self._fig_pos = figure_pos
         self._fig_sz = figure_size
+        self._figures = []  # every file the slide includes, for _figure_types
+        self._fig_files = ()
         if figure:
             if not isinstance(figure_size, (list)):
                 if not isinstance(figure_size, (int, float, tuple)):
@@ -427,7 +499,6 @@ class Slide(object):
                     figure_size = list(figure_size)
                 else:
                     figure_size = [figure_size,]
-            self._fig = []
             if not isinstance(figure, (list, tuple)):
                 if not isinstance(figure, basestring):
                     raise TypeError, "figure should be string, tuple or list"
@@ -437,19 +508,11 @@ class Slide(object):
                     figure_size *= len(figure)
             for i in range(len(figure_size)):
                 figure_size[i] = float(figure_size[i])
-                figure_size[i] *= Content.fig_scale
-            if figure_pos in ['w', 'e']:
-                for i in range(len(figure_size)):
-                    figure_size[i] *= 2
-                    figure_size[i] /= len(figure)
-            for (f, fs) in zip(figure, figure_size):
-                _fig = r'\centerline{\includegraphics[width=%f\linewidth,keepaspectratio' % fs
-                if figure_angle:
-                    _fig += r',angle=%s' %(str(figure_angle))
-                _fig += r']{%s}}' %(f)
-                self._fig.append(_fig)
-        else:
-            self._fig = None
+            self._fig_files = figure
+            self._fig_sizes = figure_size
+            self._fig_angle = figure_angle
+            self._figures += [f for (f, fs) in zip(figure, figure_size)]
+        self._fig = self._fig_latex(Content.fig_scale)
 
         self._left_column_width = float(left_column_width)
         self._right_column_width = 1.0 - left_column_width
@@ -457,6 +520,23 @@ class Slide(object):
         for c in content:
             self.add_content(TextBlock(c) if isinstance(c, str) else c)
 
+    def _fig_latex(self, fig_scale):
+        "The LaTeX for each of the slide's figures, or None if it has none"
+        if not self._fig_files:
+            return None
+        figs = []
+        for (f, fs) in zip(self._fig_files, self._fig_sizes):
+            fs *= fig_scale
+            if self._fig_pos in ['w', 'e']:
+                fs *= 2
+                fs /= len(self._fig_files)
+            _fig = r'\centerline{\includegraphics[width=%f\linewidth,keepaspectratio' % fs
+            if self._fig_angle:
+                _fig += r',angle=%s' %(str(self._fig_angle))
+            _fig += r']{%s}}' %(f)
+            figs.append(_fig)
+        return figs
+
     @property
     def hide(self):
         self.hidden = True
@@ -469,6 +549,7 @@ class Slide(object):
     def add_content(self, content):
         if content._verbatim:
             self._fragile = True
+        self._figures += _figure_files([content])
         self.content.append(content)
 
 class BulletSlide(Slide):
@@ -541,45 +622,222 @@ class MappingSlide(Slide):
         self.add_content(Raw(rawtext))
 
 
-class LatexBuffer(object):
-    """ Verifying LaTeX buffer """
-    __rePhrases = [re.compile(p) for p in ['\b', r'\sexttt\{.+\}',]]
+class Ptex2tex(object):
+    """
+    Does what the ptex2tex tool does to a document, in-process and a piece
+    at a time: keeps or drops the lines between "% #ifdef NAME" (or
+    "#ifndef"), "% #else" and "% #endif" according to defines, and turns
+    ptex2tex code environments (\\bpycod ... \\epycod) into Verbatim,
+    formatted as Code formats its own.
+    """
+    directive_re = re.compile(r'^%\s*#\s*(ifdef|ifndef|else|endif|define|undef|if|elif|include)\b\s*(\w*)')
+    envir_re = re.compile(r'^\\([be])(%s)\s*$' % '|'.join(sorted(set(_ptex2tex_envirs().split()))))
+    begin = r'\begin{Verbatim}[fontsize=\footnotesize,tabsize=4,baselinestretch=0.85,fontfamily=tt,xleftmargin=7mm]'
+    end = r'\end{Verbatim}'
+
+    def __init__(self, defines=()):
+        self.defines = set(defines)
+        self._kept = []  # for each open #ifdef, whether its lines are kept
+        self._partial = ''  # the last line fed, if it has not ended yet
+
+    def feed(self, text):
+        "Return the processed text of the lines text completes"
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        return ''.join([self._line(line) + '\n' for line in lines if self._keep(line)])
+
+    def close(self):
+        "Return what is left, once the whole document has been fed"
+        text = ''
+        if self._partial and self._keep(self._partial):
+            text = self._line(self._partial)
+        self._partial = ''
+        if self._kept:
+            raise ValueError, '%d "#ifdef" left open at the end of the document' % len(self._kept)
+        return text
+
+    def _keep(self, line):
+        m = self.directive_re.match(line)
+        if m is None:
+            return False not in self._kept
+        directive, name = m.groups()
+        if directive in ('ifdef', 'ifndef'):
+            self._kept.append((name in self.defines) == (directive == 'ifdef'))
+        elif directive in ('else', 'endif'):
+            if not self._kept:
+                raise ValueError, '"#%s" without "#ifdef": %s' % (directive, line)
+            if directive == 'else':
+                self._kept[-1] = not self._kept[-1]
+            else:
+                self._kept.pop()
+        elif directive == 'define':
+            if False not in self._kept:
+                self.defines.add(name)
+        elif directive == 'undef':
+            if False not in self._kept:
+                self.defines.discard(name)
+        else:
+            raise ValueError, 'ptex2tex directive not supported here: %s' % line
+        return False
 
-    def __init__(self):
-        self._buf = StringIO()
-        self._verbatim = False
+    def _line(self, line):
+        m = self.envir_re.match(line)
+        if m is None:
+            return line
+        return self.begin if m.group(1) == 'b' else self.end
 
-    def tell(self):
-        return self._buf.tell()
+def _fingerprint(obj):
+    """
+    A string that changes whenever obj, a slide or something on one,
+    would render differently. Slides and Content are described by their
+    class and attributes (and Content by its LaTeX code, but not by its
+    _memos); other objects only by their class.
+    """
+    if isinstance(obj, (basestring, int, long, float, type(None))):
+        return repr(obj)
+    if isinstance(obj, (list, tuple)):
+        return '[%s]' % ', '.join([_fingerprint(o) for o in obj])
+    if isinstance(obj, dict):
+        return '{%s}' % _fingerprint(sorted(obj.items()))
+    name = '%s.%s' % (type(obj).__module__, type(obj).__name__)
+    if isinstance(obj, (Slide, Content)):
+        state = dict(vars(obj))
+        if isinstance(obj, Content):
+            state['_ltx'] = getattr(obj, '_ltx', None)
+            for memo in obj._memos:
+                state.pop(memo, None)
+        return '%s(%s)' % (name, _fingerprint(state))
+    return name
+
+_source_hashes = {}
+
+def _source_hash(cls):
+    """
+    A hash of the source of the modules defining cls and its bases, so that
+    slides rendered before a change to the renderer are not reused.
+    """
+    if cls not in _source_hashes:
+        h = hashlib.sha1()
+        paths = set([inspect.getsourcefile(c) or c.__module__ for c in cls.__mro__ if c is not object])
+        for path in sorted(paths):
+            h.update(path + '\0')
+            try:
+                f = open(path)
+            except IOError:
+                continue
+            h.update(f.read())
+            f.close()
+        _source_hashes[cls] = h.hexdigest()
+    return _source_hashes[cls]
+
+class RenderCache(object):
+    """
+    Rendered slides by key, kept in memory and, if directory is given,
+    in a file per slide there too, so that they outlast the process.
 
-    def write(self, txt, validate=True):
-        """
-        Write text to buffer after, after optionally checking
-        whether LaTeX backslashes are there or raw strings have
-        been forgotten.
-        """
-        if validate:
-            for rp in self.__rePhrases:
-                #print 'checking "%s" in %s' % (p, string)
-                if rp.search(txt):
-                    raise ValueError, \
-                          'This text,\n----\n%s\n----\ncontains '\
-                          'LaTeX commands but was not typed as a raw string' \
-                          % txt
-
-        # Why this??? Nothing happens and actions for verbatim envirs
-        # are taken in _verbatim_text
-        if not self._verbatim:
-            phrases = _verbatim_phrases()
-            for p in phrases:
-                if txt.find(p) != -1:
-                    self._verbatim = True
+    Each holds at most about max_bytes of LaTeX: past that, the least
+    recently used slides are dropped until half of it is left.
+    """
+    def __init__(self, directory=None, max_bytes=32*1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._slides = {}
+        self._used = {}  # when each slide in memory was last used
+        self._clock = 0
+        self._memory_size = 0
+        self._size = None  # of the directory, once known
+
+    def _touch(self, key):
+        self._clock += 1
+        self._used[key] = self._clock
+
+    def get(self, key):
+        text = self._slides.get(key)
+        if text is not None:
+            self._touch(key)
+            return text
+        if self.directory is None:
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            f = open(path)
+        except IOError:
+            return None
+        text = f.read()
+        f.close()
+        try:
+            os.utime(path, None)  # mark as recently used
+        except OSError:  # evicted meanwhile, by another build
+            pass
+        self._remember(key, text)
+        return text
+
+    def put(self, key, text):
+        self._remember(key, text)
+        if self.directory is not None:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            path = os.path.join(self.directory, key)
+            # Write then rename, so a reader never sees half a slide
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            f = open(tmp, 'w')
+            f.write(text)
+            f.close()
+            os.rename(tmp, path)
+            if self._size is None:
+                self._size = sum([size for _, size, _ in self._entries()])
+            else:
+                self._size += len(text)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _remember(self, key, text):
+        if key in self._slides:
+            self._memory_size -= len(self._slides[key])
+        self._slides[key] = text
+        self._memory_size += len(text)
+        self._touch(key)
+        if self._memory_size > self.max_bytes:
+            for used, key in sorted([(used, key) for key, used in self._used.items()]):
+                if self._memory_size <= self.max_bytes // 2:
                     break
-
-        self._buf.write(txt)
-
-    def get_text(self):
-        return self._buf.getvalue()
+                self._memory_size -= len(self._slides.pop(key))
+                del self._used[key]
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):  # being written by put()
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:  # removed by a concurrent build
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self._size = sum([size for _, size, _ in entries])
+        for _, size, path in entries:
+            if self._size <= self.max_bytes // 2:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # already evicted, by another build
+                pass
+            self._size -= size
+
+    def clear(self):
+        self._slides.clear()
+        self._used.clear()
+        self._memory_size = 0
+        if self.directory is not None and os.path.isdir(self.directory):
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._size = 0
 
 class SubSection(object):
     """A presentation Subsection"""
@@ -623,6 +881,18 @@ class Section(object):
 
 class Slides(object):
     """ Superclass for different slide packages."""
+    # Where to reuse rendered slides from: None always renders, a
+    # RenderCache() shares them between the decks of a process, and a
+    # RenderCache(directory) keeps them between runs too
+    render_cache = None
+    # Whether _renderSlide renders hidden slides too
+    render_hidden = False
+    # Render the sections in this many processes; the output is the same
+    render_processes = 1
+    # Names to resolve ptex2tex's "% #ifdef" with while rendering, so the
+    # written file is final; None leaves the directives for ptex2tex
+    ptex2tex_defines = None
+
     def __init__(self,
                  title='Here goes the title of the talk',
                  author_and_inst=[('author1','inst1'),
@@ -673,24 +943,30 @@ class Slides(object):
         self.sections = []
         self.buf = StringIO()
         self._dim = False
+        self.context = RenderContext()
         self._header()
         self._init_titlepage()
         self._titlepage()
-        self.renderContent = {}
-        # The render methods for most Content subclasses must be moved to the
-        # subclasses of Slides, as they are package-dependent. In order to
-        # keep track of which one to call, we create a dictionary that maps
-        # the type of the Content subclass to a renderfunction specific for
-        # that subclass. Hence, renderContent[BulletBlock] refers to
-        # Slide._renderBulletBlock():
-        for subclass in Content.__subclasses__():
-            self.addSubClasses(subclass)
-
-    def addSubClasses(self, content, root=True):
-        if root == True: root = content
-        self.renderContent[content] = eval('self._render%s' % root.__name__)
-        for c in content.__subclasses__():
-            self.addSubClasses(c, root)
+
+    # The render methods for most Content subclasses must be moved to the
+    # subclasses of Slides, as they are package-dependent. _renderContent
+    # calls the one for the nearest class along the content's MRO, so
+    # BulletBlock goes to _renderBulletBlock and a Code subclass defined
+    # anywhere, at any time, to _renderCode. The method names found are
+    # cached per (Slides class, Content class) pair in _renderers.
+    _renderers = {}
+
+    def _renderContent(self, content):
+        key = (type(self), type(content))
+        name = Slides._renderers.get(key)
+        if name is None:
+            for cls in type(content).__mro__:
+                if cls is Content:
+                    raise TypeError, 'Cannot render %s objects' % type(content).__name__
+                if hasattr(self, '_render' + cls.__name__):
+                    name = Slides._renderers[key] = '_render' + cls.__name__
+                    break
+        getattr(self, name)(content)
 
     def _header(self):
         pass
@@ -786,29 +1062,204 @@ class Slides(object):
         for slide in slides:
             self.add_slide(slide)
 
+    def iter_slides(self, hidden=False):
+        """ Iterate over every slide in the presentation, in order. """
+        for s in self.slides:
+            if hidden or not s.hidden:
+                yield s
+        for section in self.sections:
+            for s in section.slides:
+                if hidden or not s.hidden:
+                    yield s
+            for subsection in section.subsections:
+                for s in subsection.slides:
+                    if hidden or not s.hidden:
+                        yield s
+
+    def iter_content(self, hidden=False):
+        """
+        Iterate over every Content object in the presentation, including
+        those nested inside blocks and bullet lists.
+        """
+        for s in self.iter_slides(hidden):
+            for c in _iter_content(s.content):
+                yield c
+
+    def _figure_types(self):
+        """
+        Count the figures in the slides that will be rendered, by file
+        extension, as collected when the slides were built.
+        """
+        figfiletypes = {}
+        for s in self.iter_slides():
+            for fname in s._figures:
+                ext = os.path.splitext(fname)[1]
+                figfiletypes[ext] = figfiletypes.get(ext, 0) + 1
+        return figfiletypes
+
     def get_latex(self):
+        return ''.join(self.iter_latex())
+
+    def iter_latex(self):
+        """
+        Generate the LaTeX document piece by piece: the preamble, each
+        section and subsection heading, each slide and the end.
+
+        Each piece is checked for LaTeX commands that were not typed as
+        raw strings; after the last one, a ValueError lists every one
+        found, with the slide or heading it is in.
+        """
+        self._options = _fingerprint(self._render_options())
+        ptex2tex = None
+        if self.ptex2tex_defines is not None:
+            ptex2tex = Ptex2tex(self.ptex2tex_defines)
+        errors = []
+        for where, text in self._iter_pieces():
+            errors += self._validate(text, where)
+            yield text if ptex2tex is None else ptex2tex.feed(text)
+        if ptex2tex is not None:
+            yield ptex2tex.close()
+        if errors:
+            raise ValueError, \
+                  'This text contains LaTeX commands but was not typed ' \
+                  'as a raw string\n' + '\n'.join(errors)
+
+    def _iter_pieces(self):
+        """
+        Render the document, yielding (where, text) each time a piece of
+        it is done. The backends' _render methods write to self.buf, which
+        starts out empty for every piece.
+        """
         self.buf = StringIO()
-        self.buf.write(self._ltx)
+        preamble = self._content_preamble()
+        self.buf.write(self._ltx.replace('\\begin{document}', preamble + '\\begin{document}', 1))
+        yield 'the preamble', self._take()
         # Top-level slides
         for s in self.slides:
-            self._renderSlide(s)
+            self._renderCachedSlide(s)
+            yield 'slide "%s"' % s.title, self._take()
         # Now the nested content
-        for s in self.sections:
-            self._renderSection(s)
+        for pieces in self._iter_sections():
+            for piece in pieces:
+                yield piece
 
         self.buf.write(r"""
 \end{document}
 """)
+        yield 'the end of the document', self._take()
+
+    def _content_preamble(self):
+        "The preamble LaTeX the content asks for, each piece once"
+        pieces = []
+        for c in self.iter_content(hidden=True):
+            for text in c._preamble:
+                if text not in pieces:
+                    pieces.append(text)
+        return ''.join(pieces)
+
+    def _section_pieces(self, section):
+        "The (where, text) pieces of one section, as _iter_pieces yields them"
+        self.buf.write("\n")
+        self._renderSectionTitle(section)
+        yield 'section "%s"' % section._title, self._take()
+        # Top-level slides
+        for s in section.slides:
+            self.buf.write("\n")
+            self._renderCachedSlide(s)
+            yield 'slide "%s"' % s.title, self._take()
+        # Nested slides
+        for subsection in section.subsections:
+            self.buf.write("\n")
+            self._renderSubsectionTitle(subsection)
+            yield 'subsection "%s"' % subsection._title, self._take()
+            for s in subsection.slides:
+                self.buf.write("\n")
+                self._renderCachedSlide(s)
+                yield 'slide "%s"' % s.title, self._take()
+
+    def _iter_sections(self):
+        """
+        Yield the pieces of each section in turn, rendering the sections
+        in render_processes processes if that is more than one.
+        """
+        if self.render_processes <= 1 or len(self.sections) < 2:
+            for section in self.sections:
+                yield self._section_pieces(section)
+            return
+
+        global _parallel_deck
+        # Work out content that is only made when first needed (such as
+        # custom.ShellCode transcripts) here, not once in every process;
+        # only on the slides that are rendered, as hidden ones never run
+        for c in self.iter_content(hidden=self.render_hidden):
+            getattr(c, '_ltx', None)
+        # The processes are forked, so they find the deck here rather
+        # than having it pickled
+        _parallel_deck = self
+        pool = multiprocessing.Pool(self.render_processes)
+        try:
+            for pieces in pool.imap(_render_section, range(len(self.sections))):
+                yield pieces
+        finally:
+            pool.terminate()
+            pool.join()
+            _parallel_deck = None
+
+    def _render_options(self):
+        """
+        Everything besides the slide itself that its LaTeX depends on: the
+        backend and the source it is rendered by, its public options
+        (header_footer, handout, the theme, ...) and its render context.
+        """
+        options = [(k, v) for k, v in vars(self).items()
+                   if not k.startswith('_') and k not in
+                   ('buf', 'slides', 'sections', 'context', 'render_cache', 'render_processes',
+                    'render_hidden', 'ptex2tex_defines')]
+        return [type(self).__module__, type(self).__name__, _source_hash(type(self)),
+                vars(self.context), sorted(options)]
+
+    def _renderCachedSlide(self, slide):
+        "Like _renderSlide, but reuse the LaTeX of an identical slide"
+        # A hidden slide is not fingerprinted: that would make its content
+        # (custom.ShellCode runs its snippet) only to leave it out
+        if self.render_cache is None or (slide.hidden and not self.render_hidden):
+            self._renderSlide(slide)
+            return
+        key = hashlib.sha1(self._options + _fingerprint(slide)).hexdigest()
+        text = self.render_cache.get(key)
+        if text is None:
+            buf = self.buf
+            self.buf = StringIO()
+            self._renderSlide(slide)
+            text = self.buf.getvalue()
+            self.buf = buf
+            self.render_cache.put(key, text)
+        self.buf.write(text)
+
+    def _take(self):
+        "Return what has been written to self.buf and start a new one"
+        text = self.buf.getvalue()
+        self.buf = StringIO()
+        return text
 
-        return self.buf.getvalue()
+    def _validate(self, text, where):
+        """
+        Return a message for each LaTeX command in text, a piece of the
+        document from where, that was not typed as a raw string.
+        """
+        errors = []
+        for match in _unraw_re.finditer(text):
+            line = text[text.rfind('\n', 0, match.start()) + 1:text.find('\n', match.end())]
+            errors.append('In %s, offset %d:\n----\n%s\n----' % (where, match.start(), line))
+        return errors
 
     def _renderSlide(self, slide):
         pass
 
-    def _renderSection(self, section):
+    def _renderSectionTitle(self, section):
         pass
 
-    def _renderSubsection(self, subsection):
+    def _renderSubsectionTitle(self, subsection):
         pass
 
     def _renderRaw(self, raw):
@@ -821,7 +1272,8 @@ class Slides(object):
         bulletlist.render(self.buf)
 
     def _renderCode(self, code):
-        code.render(self.buf)
+        self.buf.write(code.latex(self.context))
+        self.buf.write("\n")
 
     def _renderTable(self, table):
         table.render(self.buf)
@@ -842,11 +1294,24 @@ class Slides(object):
         tableblock.render(self.buf)
 
     def write(self, filename):
-        text = self.get_latex()
         of = open(filename, 'w')
-        of.write(text)
+        try:
+            for text in self.iter_latex():
+                of.write(text)
+        except:
+            # Do not leave half a document behind
+            of.close()
+            os.remove(filename)
+            raise
         of.close()
 
+_parallel_deck = None  # the Slides whose sections _render_section renders
+
+def _render_section(i):
+    deck = _parallel_deck
+    deck.buf = StringIO()
+    return list(deck._section_pieces(deck.sections[i]))
+
 def make_tree(sections, parent=None):
     if parent is None:
         return [make_tree(section, "root") for section in sections]
@@ -10,11 +10,12 @@ class DoconceSlides(Slides):
     @ivar sections: Eventual sections that the document is divided into, each section collects itself a number of slides
     and possibly also subsections.
     """
+    render_hidden = True
 
     def __init__(self, *args, **kwargs):
         Slides.__init__(self, *args, **kwargs)
 
-        Code.latex_envir = 'doconce'
+        self.context.latex_envir = 'doconce'
 
     # Document header
     def _header(self):
@@ -70,8 +71,9 @@ FIGURE: [%s, width=400 frac=%s]
         # Do not ignore hidden slides, dump all
         if isinstance(slide, RawSlide):
             c = slide.content[0]
-            self.renderContent[type(c)](c)
+            self._renderContent(c)
             return
+        figs = slide._fig_latex(self.context.fig_scale)
 
         self.buf.write(r"""
 
@@ -91,7 +93,7 @@ FIGURE: [%s, width=400 frac=%s]
             return text
 
         def write_figure(row, start_column=0, cells=True, width=1):
-            for i, slide_text in enumerate(slide._fig):
+            for i, slide_text in enumerate(figs):
                 m = re.search(r'\\centerline{\\includegraphics\[width=(.+?)\\linewidth.+?\]\{(.+?)\}', slide_text)
                 if m:
                     filename = m.group(2).strip()
@@ -121,17 +123,17 @@ FIGURE: [%s, width=%d frac=%.1f]
         for c in slide.content[:-1]:
             if slide._dim == 'blocks':
                 self.buf.write("!bpop\n")
-            self.renderContent[type(c)](c)
+            self._renderContent(c)
             if slide._dim == 'blocks':
                 self.buf.write("!epop\n")
         for c in slide.content[-1:]:
             if slide._dim == 'blocks':
                 self._dim = False
                 self.buf.write("!bpop\n")
-                self.renderContent[type(c)](c)
+                self._renderContent(c)
                 self.buf.write("!epop\n")
             else:
-                self.renderContent[type(c)](c)
+                self._renderContent(c)
         self._dim = False
         slide_text = self.buf.getvalue()
         self.buf = buf
@@ -139,35 +141,35 @@ FIGURE: [%s, width=%d frac=%.1f]
         # If figure is to the north:
         # If figure is to the north:
         # Use cells for figure, but not for text
-        if slide._fig and slide._fig_pos == 'n':
+        if figs and slide._fig_pos == 'n':
             self.buf.write(
-                write_figure(row=0, start_column=0, cells=len(slide._fig) > 1,
-                             width=1/len(slide._fig)))
+                write_figure(row=0, start_column=0, cells=len(figs) > 1,
+                             width=1/len(figs)))
             self.buf.write(
                 write_text(row=1, column=0, cells=False,
                            width=1) % slide_text)
 
         # If figure is to the south:
         # Use cells for figure, but not for text
-        elif slide._fig and slide._fig_pos == 's':
+        elif figs and slide._fig_pos == 's':
             self.buf.write(
                 write_text(row=0, column=0, cells=False,
                            width=1) % slide_text)
             self.buf.write(
-                write_figure(row=1, start_column=0, cells=len(slide._fig) > 1,
-                             width=1/len(slide._fig)))
+                write_figure(row=1, start_column=0, cells=len(figs) > 1,
+                             width=1/len(figs)))
 
         # If figure is to the west:
-        elif slide._fig and slide._fig_pos == 'w':
+        elif figs and slide._fig_pos == 'w':
             self.buf.write(
                 write_fig(row=0, start_column=0, cells=True,
                           width=slide._left_column_width))
             self.buf.write(
-                write_text(row=1, column=len(slide._fig)+1, cells=True,
+                write_text(row=1, column=len(figs)+1, cells=True,
                            width=1-slide._left_column_width) % slide_text)
 
         # If figure is to the east:
-        elif slide._fig and slide._fig_pos == 'e':
+        elif figs and slide._fig_pos == 'e':
             self.buf.write(
                 write_text(row=1, column=0, cells=True,
                            width=1-slide._right_column_width) % slide_text)
@@ -181,25 +183,13 @@ FIGURE: [%s, width=%d frac=%.1f]
 
         self._dim = False
 
-    def _renderSection(self, section):
-        self.buf.write("\n")
+    def _renderSectionTitle(self, section):
         self.buf.write(r"""======= %s =======
 """% (section._title))
-        # Top-level slides
-        for s in section.slides:
-            self.buf.write("\n")
-            self._renderSlide(s)
-        # Nested slides
-        for s in section.subsections:
-            self.buf.write("\n")
-            self._renderSubsection(s)
-
-    def _renderSubsection(self, subsection):
+
+    def _renderSubsectionTitle(self, subsection):
         self.buf.write(r"""===== %s =====
 """ % (subsection._title))
-        for s in subsection.slides:
-            self.buf.write("\n")
-            self._renderSlide(s)
 
     def _renderBulletList(self, bulletlist):
         if self._dim == True or self._dim =='progressive':
@@ -213,7 +203,7 @@ FIGURE: [%s, width=%d frac=%.1f]
                     self.buf.write(' '*indent + '* ')
                     if isinstance(bi, basestring):
                         bi = Text(bi)
-                    self.renderContent[type(bi)](bi)
+                    self._renderContent(bi)
                 indent -= 2
             elif isinstance(b, BulletList):
                 pass
@@ -222,30 +212,31 @@ FIGURE: [%s, width=%d frac=%.1f]
                 self.buf.write(' '*indent + '* ')
                 if isinstance(b, basestring):
                     b = Text(b)
-                self.renderContent[type(b)](b)
+                self._renderContent(b)
         if bulletlist.bullets:
             self.buf.write('\n')
 
     def _renderBlock(self, block):
-        if Block.unblock:
+        if self.context.unblock:
             if block.heading:
                 self.buf.write(r"""_%s_
 
 """ % block.heading)
         else:
-            if block.heading:
-                block.heading = " %s" % block.heading
+            heading = block.heading
+            if heading:
+                heading = " %s" % heading
             self.buf.write(r"""
 !bblock%s
 
-""" % block.heading)
+""" % heading)
 
         for c in block.content:
             if isinstance(c, basestring):
                 c = Text(c)
-            self.renderContent[type(c)](c)
+            self._renderContent(c)
 
-        if Block.unblock:
+        if self.context.unblock:
             pass
         else:
             self.buf.write(r"""
@@ -15,13 +15,13 @@ class HTMLSlides(BeamerSlides):
         kwargs['toc_heading'] = ''
         BeamerSlides.__init__(self, *args, **kwargs)
 
-    def get_latex(self):
+    def iter_latex(self):
         slides = self.slides[:]
         self.slides = []
         for s in slides:
             if not isinstance(s, (Section, SubSection)):
                 self.add_slide(s)
-        return Slides.get_latex(self)
+        return Slides.iter_latex(self)
 
     def write(self, filename):
         Slides.write(self, filename)
@@ -6,8 +6,8 @@ class ProsperSlides(Slides):
     """
     def __init__(self, *args, **kwargs):
         Slides.__init__(self, *args, **kwargs)
-        Content.fig_scale = 0.8
-        Content.font_scale = True
+        self.context.fig_scale = 0.8
+        self.context.font_scale = True
         # Fix \emp such that the font is smaller
         # (adjusted for hplplainsmall)
         self.newcommands[0] = r"{\emp}[1]{{\relsize{-3}\texttt{#1}}}"
@@ -94,20 +94,21 @@ class ProsperSlides(Slides):
 
         if isinstance(slide, RawSlide):
             c = slide.content[0]
-            self.renderContent[type(c)](c)
+            self._renderContent(c)
             return
+        figs = slide._fig_latex(self.context.fig_scale)
         
         self.buf.write(r"""\begin{slide}{%s}
 
 """ % (slide.title))
 
         # If figure is to the north:
-        if slide._fig and slide._fig_pos == 'n':
-            width = 1./len(slide._fig)
+        if figs and slide._fig_pos == 'n':
+            width = 1./len(figs)
             self.buf.write(r"""
 \begin{tabular}{l}
 """)
-            for i in slide._fig:
+            for i in figs:
                 self.buf.write(r"""
 \begin{minipage}{%g\textwidth}
 %s
@@ -117,12 +118,12 @@ class ProsperSlides(Slides):
 \end{tabular}
 """)
         # If figure is to the west:
-        if slide._fig and slide._fig_pos == 'w':
+        if figs and slide._fig_pos == 'w':
             self.buf.write(r"""
 \begin{minipage}[t]{%g\textwidth}
 \begin{figure}[ht]
 """ %(0.95*slide._left_column_width))
-            for i in slide._fig:
+            for i in figs:
                 self.buf.write(r"""
 \mbox{
 \subfigure{%s}
@@ -135,22 +136,22 @@ class ProsperSlides(Slides):
 """ %(0.95*slide._right_column_width))
 
         # If figure is to the east:
-        if slide._fig and slide._fig_pos == 'e':
+        if figs and slide._fig_pos == 'e':
             self.buf.write(r"""
 \begin{minipage}[t]{%g\textwidth}
 """ %(0.95*slide._left_column_width))
 
         for c in slide.content:
-            self.renderContent[type(c)](c)
+            self._renderContent(c)
 
         # If figure is to the east:
-        if slide._fig and slide._fig_pos == 'e':
+        if figs and slide._fig_pos == 'e':
             self.buf.write(r"""
 \end{minipage}
 \begin{minipage}[t]{%g\textwidth}
 \begin{figure}[ht]
 """ %(0.95*slide._right_column_width))
-            for i in slide._fig:
+            for i in figs:
                 self.buf.write(r"""
 \mbox{
 \subfigure{%s}
@@ -161,18 +162,18 @@ class ProsperSlides(Slides):
 \end{minipage}
 """)
         # If figure is to the west:
-        if slide._fig and slide._fig_pos == 'w':
+        if figs and slide._fig_pos == 'w':
             self.buf.write(r"""
 \end{minipage}
 """)
 
         # If figure is to the south:
-        if slide._fig and slide._fig_pos == 's':
-            width = 1./len(slide._fig)
+        if figs and slide._fig_pos == 's':
+            width = 1./len(figs)
             self.buf.write(r"""
 \begin{tabular}{l}
 """)
-            for i in slide._fig:
+            for i in figs:
                 self.buf.write(r"""
 \begin{minipage}{%g\textwidth}
 %s
@@ -186,33 +187,21 @@ class ProsperSlides(Slides):
 \end{slide}
 """)
                 
-    def _renderSection(self, section):
-        self.buf.write("\n")
+    def _renderSectionTitle(self, section):
         self.buf.write(r"""\newpart{%s}{}
 """ % (section._title))
-        # Top-level slides
-        for s in section.slides:
-            self.buf.write("\n")
-            self._renderSlide(s)
-        # Nested slides
-        for s in section.subsections:
-            self.buf.write("\n")
-            self._renderSubsection(s)
 
-    def _renderSubsection(self, subsection):
+    def _renderSubsectionTitle(self, subsection):
         self.buf.write(r"""\newpart{%s}{}
 """ % (subsection._title))
-        for s in subsection.slides:
-            self.buf.write("\n")
-            self._renderSlide(s)
-                       
+
     def _renderBulletList(self, bulletlist):
         self.buf.write("\n" + r"""\begin{itemize}
 """)
         for b in bulletlist.bullets:
             if isinstance(b, list):
                 b = BulletList(b)
-                self.renderContent[type(b)](b)
+                self._renderContent(b)
             elif isinstance(b, BulletList):
                 pass
                 # Nested list
@@ -220,7 +209,7 @@ class ProsperSlides(Slides):
                 self.buf.write(r"\item ")
                 if isinstance(b, basestring):
                     b = Text(b)
-                self.renderContent[type(b)](b)
+                self._renderContent(b)
 
         self.buf.write(r"""\end{itemize}""" + "\n")
 
@@ -234,7 +223,7 @@ class ProsperSlides(Slides):
         for c in block.content:
             if isinstance(c, basestring):
                 c = Text(c)
-            self.renderContent[type(c)](c)
+            self._renderContent(c)
 
         if isinstance(block, TableBlock):
             if block.center:
@@ -261,17 +250,7 @@ class ProsperSlides(Slides):
         else:
             ptex2tex_line = ''
         # Check if latex or pdflatex, depending on figure extensions
-        text = self.get_latex()
-        import re
-        pattern = 'includegraphics\[.+?\]\{(.+?)\}'
-        figfiles = re.findall(pattern, text)
-        figfiletypes = {}
-        for fname in figfiles:
-            ext = os.path.splitext(fname)[1]
-            if not ext in figfiletypes:
-                figfiletypes[ext] = 1
-            else:
-                figfiletypes[ext] += 1
+        figfiletypes = self._figure_types()
         def check(illegal):
             # Check if other illegal image types are present
             for name in illegal:
@@ -1,5 +1,11 @@
 import sys
 from latexslides.beamer import BeamerSlides
+import custom
+
+if 'clear-cache' in sys.argv:
+    custom.cache.clear()
+    custom.highlights.clear()
+
 import meta, basics
 
 
@@ -28,6 +34,12 @@ slides = BeamerSlides(
 sections = [meta, basics]
 for section in sections:
     slides.add_slides(section.section, generate_slides=True)
+if "async" in sys.argv:
+    custom.execute_async(slides)
+else:
+    custom.execute_all(slides)
 
-# Dump to file:
-slides.write("compiled/lesson.p.tex")
+# Dump to file, resolving the "% #ifdef MINTED" blocks here rather than with ptex2tex:
+slides.ptex2tex_defines = ["MINTED"] if custom.highlight is None else []
+slides.write("compiled/lesson.tex")
+custom.report()
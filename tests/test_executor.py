@@ -0,0 +1,123 @@
+"""
+Tests for executor.py, run in this process (Python 3):
+
+    python3 -m unittest discover -s tests -p 'test_executor.py'
+
+Snippets that could take the test process down with them (os._exit, the
+memory limit) run through run_forked.
+"""
+
+import json
+import os
+import signal
+import sys
+import unittest
+from io import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import executor
+except ImportError:  # Python 2, which the rest of the repo runs on
+    executor = None
+
+
+def request(code, mode="shell", data="", **options):
+    return dict(options, mode=mode, code=code, data=data)
+
+
+@unittest.skipIf(executor is None, "executor.py runs on Python 3")
+class RunTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = signal.signal(signal.SIGALRM, executor.alarm)
+
+    def tearDown(self):
+        signal.signal(signal.SIGALRM, self.handler)
+
+    def test_shell(self):
+        output, overrun = executor.run(request("1 + 1\nprint('hi')"))
+        self.assertEqual(output, ">>> 1 + 1\n2\n>>> print('hi')\nhi\n\n")
+        self.assertIsNone(overrun)
+
+    def test_exec(self):
+        output, overrun = executor.run(request("print(input('? '))", mode="exec", data="42\n"))
+        self.assertEqual(output, "? 42\n42\n")
+        self.assertIsNone(overrun)
+
+    def test_timeout(self):
+        output, overrun = executor.run(request("print('start')\nwhile True: pass", timeout=0.5))
+        self.assertEqual(overrun, "timeout")
+        self.assertTrue(output.endswith(executor.TIMEOUT % 0.5))
+        self.assertIn("start", output)
+
+    def test_truncated(self):
+        output, overrun = executor.run(request("for i in range(100): print(i)", mode="exec", max_lines=3))
+        self.assertEqual(output, "0\n1\n2\n" + executor.TRUNCATED)
+        self.assertIsNone(overrun)
+
+    def test_sys_exit(self):
+        output, overrun = executor.run(request("print(1)\nimport sys\nsys.exit()\nprint(2)"))
+        self.assertIn("1\n", output)
+        self.assertNotIn("print(2)", output)
+        self.assertIsNone(overrun)
+
+    def test_forked_exit(self):
+        output, overrun = executor.run_forked(request("import os\nos._exit(0)"))
+        self.assertEqual((output, overrun), (executor.CRASHED, "crashed"))
+
+    def test_forked_memory(self):
+        output, overrun = executor.run_forked(
+            request("x = bytearray(2 * 2 ** 30)", mode="exec", memory=512 * 2 ** 20))
+        self.assertEqual(overrun, "memory")
+        self.assertTrue(output.endswith(executor.OUT_OF_MEMORY % 512))
+
+
+@unittest.skipIf(executor is None, "executor.py runs on Python 3")
+class ServeTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = signal.signal(signal.SIGALRM, executor.alarm)
+
+    def tearDown(self):
+        signal.signal(signal.SIGALRM, self.handler)
+
+    def serve(self, requests, runner=None):
+        responses = StringIO()
+        lines = "".join(json.dumps(dict(r, id=i)) + "\n" for i, r in enumerate(requests))
+        executor.serve(StringIO(lines), responses, runner or executor.run)
+        return [json.loads(line) for line in responses.getvalue().splitlines()]
+
+    def test_ids(self):
+        responses = self.serve([request("1"), request("2", mode="exec")])
+        self.assertEqual([r["id"] for r in responses], [0, 1])
+        self.assertEqual(responses[0]["output"], ">>> 1\n1\n\n")
+
+    def test_session(self):
+        responses = self.serve([request("x = 1", session="s", fresh=True),
+                                request("x + 1", session="s"),
+                                request("'x' in dir()")])
+        self.assertEqual(responses[1]["output"], ">>> x + 1\n2\n\n")
+        self.assertEqual(responses[2]["output"], ">>> 'x' in dir()\nFalse\n\n")
+
+    def test_fresh_session(self):
+        responses = self.serve([request("x = 1", session="s", fresh=True),
+                                request("'x' in dir()", session="s", fresh=True)])
+        self.assertEqual(responses[1]["output"], ">>> 'x' in dir()\nFalse\n\n")
+
+    def test_modules_reset(self):
+        responses = self.serve([request("import json\njson.x = 1"),
+                                request("import json\nhasattr(json, 'x')")])
+        self.assertEqual(responses[1]["output"], ">>> import json\n>>> hasattr(json, 'x')\nFalse\n\n")
+
+    def test_timeout_then_next(self):
+        responses = self.serve([request("while True: pass", timeout=0.5), request("2 + 2")])
+        self.assertEqual(responses[0]["overrun"], "timeout")
+        self.assertEqual(responses[1]["output"], ">>> 2 + 2\n4\n\n")
+
+    def test_forked_crash_then_next(self):
+        responses = self.serve([request("import os\nos._exit(0)"), request("2 + 2")], executor.run_forked)
+        self.assertEqual(responses[0]["overrun"], "crashed")
+        self.assertEqual(responses[1]["output"], ">>> 2 + 2\n4\n\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
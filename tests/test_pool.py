@@ -0,0 +1,96 @@
+"""
+Tests for the executor workers and pool in custom.py, which start python3
+executors (Python 2, like custom.py):
+
+    python2 -m unittest discover -s tests -p 'test_pool.py'
+"""
+
+import os
+import sys
+import unittest
+from threading import Thread
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("custom.py runs on Python 2")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import custom
+
+# Ignores the executor's own timer, so only the watchdog can stop it
+STUCK = "import signal\nsignal.signal(signal.SIGALRM, signal.SIG_IGN)\nwhile True: pass"
+
+
+def request(code, mode="shell", data="", **options):
+    return dict(options, mode=mode, code=code, data=data)
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self):
+        self.grace = custom.GRACE
+        custom.GRACE = 0.5  # kill stuck executors sooner
+        self.pool = custom.WorkerPool(size=1)
+
+    def tearDown(self):
+        self.pool.close()
+        custom.GRACE = self.grace
+
+    def test_run(self):
+        self.assertEqual(self.pool.run(request("2 + 2")), (">>> 2 + 2\n4\n\n", None))
+
+    def test_fd_output(self):
+        output, overrun = self.pool.run(request("import os\nos.system('echo hi')\n1"))
+        self.assertEqual(output, ">>> import os\n>>> os.system('echo hi')\nhi\n0\n>>> 1\n1\n\n")
+
+    def test_stuck(self):
+        results = self.pool.run_batch([request(STUCK, timeout=0.5), request("2 + 2")])
+        self.assertEqual(results, [(custom.TIMEOUT % 0.5, "timeout"), (">>> 2 + 2\n4\n\n", None)])
+        self.assertEqual(len(self.pool.workers), 1)
+
+    def test_exit(self):
+        results = self.pool.run_batch([request("import os\nos._exit(0)"), request("2 + 2")])
+        self.assertEqual(results, [(custom.CRASHED, "crashed"), (">>> 2 + 2\n4\n\n", None)])
+
+    def test_session_stops_short(self):
+        results = self.pool.run_batch([request(STUCK, timeout=0.5, session="s", fresh=True),
+                                       request("2 + 2", session="s")])
+        self.assertEqual(results, [(custom.TIMEOUT % 0.5, "timeout")])
+
+    def test_no_deadlock(self):
+        # Every worker gets killed while another thread waits for one
+        results = []
+        threads = [Thread(target=lambda: results.append(self.pool.run(request(STUCK, timeout=0.5))))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(20)
+            self.assertFalse(thread.is_alive(), "the pool deadlocked")
+        self.assertEqual([overrun for _, overrun in results], ["timeout", "timeout"])
+
+
+class SessionTest(unittest.TestCase):
+    def setUp(self):
+        self.grace = custom.GRACE
+        custom.GRACE = 0.5
+        self.pool, self.cache = custom.ShellCode.pool, custom.ShellCode.cache
+        custom.ShellCode.pool = custom.WorkerPool(size=1)
+        custom.ShellCode.cache = None
+
+    def tearDown(self):
+        custom.ShellCode.pool.close()
+        custom.ShellCode.pool, custom.ShellCode.cache = self.pool, self.cache
+        custom.GRACE = self.grace
+
+    def test_skipped(self):
+        custom.ShellCode("x = 1", session="test_skipped")
+        custom.ShellCode(STUCK, session="test_skipped", timeout=0.5)
+        custom.ShellCode("x", session="test_skipped")
+        results = custom.sessions["test_skipped"]._execute()
+        self.assertEqual([overrun for _, overrun in results], [None, "timeout", "skipped"])
+        self.assertEqual(results[2][0], custom.SKIPPED)
+
+
+if __name__ == "__main__":
+    unittest.main()